@@ -0,0 +1,837 @@
+# audit_engine.py
+# Motor de validación y corrección de URLs UTM (compartido por el validador)
+
+from urllib.parse import urlparse, parse_qs, urlencode, urlunparse, unquote
+from collections import Counter
+from concurrent.futures import as_completed
+from statistics import NormalDist
+import io, time
+import numpy as np
+import pandas as pd
+
+REQUIRED = ["utm_source", "utm_medium", "utm_campaign"]
+OPTIONAL  = ["utm_content", "utm_term"]
+
+def validate_url(url: str) -> dict:
+    errors, warnings, params = [], [], {}
+    raw = str(url).strip()
+
+    if not raw or raw.lower() in ("nan", "none", ""):
+        return {"errors": ["URL vacía o nula"], "warnings": [], "params": {}, "valid": False, "score": 0}
+
+    parsed = urlparse(raw)
+    query  = parse_qs(parsed.query, keep_blank_values=True)
+
+    if not parsed.scheme.startswith("http"):
+        errors.append("Sin esquema http(s)")
+    if " " in raw:
+        errors.append("Contiene espacios")
+
+    for param in REQUIRED:
+        if param not in query:
+            errors.append(f"Falta {param}")
+        elif not query[param][0].strip():
+            errors.append(f"{param} vacío")
+        else:
+            params[param] = query[param][0]
+
+    for param in OPTIONAL:
+        if param in query:
+            val = query[param][0].strip()
+            if val:
+                params[param] = val
+            else:
+                warnings.append(f"{param} presente pero vacío")
+
+    raw_params = parsed.query.split("&")
+    keys = [p.split("=")[0] for p in raw_params if "=" in p]
+    dupes = [k for k, c in Counter(keys).items() if c > 1]
+    if dupes:
+        warnings.append(f"Parámetros duplicados: {', '.join(dupes)}")
+
+    if parsed.fragment and "utm_" in parsed.fragment:
+        warnings.append("UTMs en fragmento # — Analytics no los recoge")
+
+    score = max(0, 100 - len(errors) * 25 - len(warnings) * 10)
+
+    return {"errors": errors, "warnings": warnings, "params": params, "valid": len(errors) == 0, "score": score}
+
+
+def fix_url(url: str) -> dict:
+    """
+    Intenta corregir automáticamente la URL.
+    Devuelve: fixed_url, fixes_applied (lista), autocorregible (bool)
+    """
+    raw = str(url).strip()
+    fixes = []
+
+    if not raw or raw.lower() in ("nan", "none", ""):
+        return {"fixed_url": raw, "fixes": [], "autocorregible": False}
+
+    # 1. Limpiar espacios en la URL base
+    if " " in raw:
+        raw = raw.replace(" ", "%20")
+        fixes.append("Espacios reemplazados por %20")
+
+    parsed = urlparse(raw)
+
+    # 2. Mover UTMs del fragmento # al query
+    fragment_params = {}
+    if parsed.fragment and "utm_" in parsed.fragment:
+        frag_qs = parse_qs(parsed.fragment, keep_blank_values=True)
+        for k, v in frag_qs.items():
+            if k.startswith("utm_"):
+                fragment_params[k] = v[0]
+        if fragment_params:
+            fixes.append(f"UTMs movidos del fragmento al query: {', '.join(fragment_params.keys())}")
+
+    # 3. Parsear query actual y eliminar duplicados (conservar primero)
+    raw_pairs = parsed.query.split("&") if parsed.query else []
+    seen_keys = {}
+    deduped   = []
+    removed_dupes = []
+    for pair in raw_pairs:
+        if "=" not in pair:
+            continue
+        k, v = pair.split("=", 1)
+        if k not in seen_keys:
+            seen_keys[k] = v
+            deduped.append((k, v))
+        else:
+            removed_dupes.append(k)
+    if removed_dupes:
+        fixes.append(f"Duplicados eliminados: {', '.join(set(removed_dupes))}")
+
+    # 4. Normalizar valores UTM a minúsculas
+    normalized = []
+    norm_list  = []
+    for k, v in deduped:
+        if k.startswith("utm_") and v != v.lower():
+            norm_list.append(k)
+            normalized.append((k, v.lower()))
+        else:
+            normalized.append((k, v))
+    if norm_list:
+        fixes.append(f"Normalizados a minúsculas: {', '.join(norm_list)}")
+
+    # 5. Añadir UTMs del fragmento si no existen ya
+    final_params = dict(normalized)
+    for k, v in fragment_params.items():
+        if k not in final_params:
+            final_params[k] = v.lower()
+
+    # 6. Reconstruir query string conservando orden (requeridos primero)
+    order = REQUIRED + OPTIONAL
+    ordered = {k: final_params[k] for k in order if k in final_params}
+    rest    = {k: v for k, v in final_params.items() if k not in ordered}
+    all_params = {**ordered, **rest}
+
+    new_query = urlencode(all_params)
+    fixed = urlunparse((parsed.scheme, parsed.netloc, parsed.path, parsed.params, new_query, ""))
+
+    # 7. ¿Es autocorregible? Solo si los 3 requeridos están presentes tras la corrección
+    result_check = validate_url(fixed)
+    autocorregible = result_check["valid"]
+
+    if not autocorregible:
+        missing = [p for p in REQUIRED if p not in all_params]
+        fixes.append(f"No autocorregible — faltan: {', '.join(missing)}")
+
+    return {
+        "fixed_url":      fixed,
+        "fixes":          fixes,
+        "autocorregible": autocorregible,
+    }
+
+
+# ── Motor fusionado: un solo análisis por URL ─────────────────────
+
+def _parse_pairs(qs):
+    """Equivalente a parse_qs(qs, keep_blank_values=True) quedándose con el primer valor de cada clave."""
+    first = {}
+    for piece in qs.split("&") if qs else []:
+        if not piece:
+            continue
+        nv = piece.split("=", 1)
+        if len(nv) != 2:
+            nv.append("")
+        name = unquote(nv[0].replace("+", " "))
+        if name not in first:
+            first[name] = unquote(nv[1].replace("+", " "))
+    return first
+
+
+def audit_url(url: str) -> dict:
+    """
+    Diagnóstico y corrección en una sola pasada: la URL se analiza una vez y de esos
+    mismos tokens salen los errores/avisos de validate_url y la URL corregida de fix_url.
+    Devuelve las claves de ambas funciones con los mismos valores.
+    """
+    raw = str(url).strip()
+
+    if not raw or raw.lower() in ("nan", "none", ""):
+        return {"errors": ["URL vacía o nula"], "warnings": [], "params": {}, "valid": False, "score": 0,
+                "fixed_url": raw, "fixes": [], "autocorregible": False}
+
+    errors, warnings, params, fixes = [], [], {}, []
+    parsed = urlparse(raw)
+    has_spaces = " " in raw
+
+    # ── Diagnóstico ──
+    if not parsed.scheme.startswith("http"):
+        errors.append("Sin esquema http(s)")
+    if has_spaces:
+        errors.append("Contiene espacios")
+
+    pieces = parsed.query.split("&") if parsed.query else []
+    query  = _parse_pairs(parsed.query)
+    for param in REQUIRED:
+        if param not in query:
+            errors.append(f"Falta {param}")
+        elif not query[param].strip():
+            errors.append(f"{param} vacío")
+        else:
+            params[param] = query[param]
+
+    for param in OPTIONAL:
+        if param in query:
+            val = query[param].strip()
+            if val:
+                params[param] = val
+            else:
+                warnings.append(f"{param} presente pero vacío")
+
+    counts = Counter(p.split("=")[0] for p in pieces if "=" in p)
+    dupes  = [k for k, c in counts.items() if c > 1]
+    if dupes:
+        warnings.append(f"Parámetros duplicados: {', '.join(dupes)}")
+
+    frag_has_utm = bool(parsed.fragment) and "utm_" in parsed.fragment
+    if frag_has_utm:
+        warnings.append("UTMs en fragmento # — Analytics no los recoge")
+
+    score = max(0, 100 - len(errors) * 25 - len(warnings) * 10)
+
+    # ── Corrección (sobre los mismos tokens) ──
+    # 1. Espacios → %20 (mismo resultado que reemplazar antes de parsear)
+    sp = (lambda s: s.replace(" ", "%20")) if has_spaces else (lambda s: s)
+    if has_spaces:
+        fixes.append("Espacios reemplazados por %20")
+
+    # 2. UTMs del fragmento (unquote("%20") == " ", así que el fragmento original sirve tal cual)
+    fragment_params = {}
+    if frag_has_utm:
+        fragment_params = {k: v for k, v in _parse_pairs(parsed.fragment).items() if k.startswith("utm_")}
+        if fragment_params:
+            fixes.append(f"UTMs movidos del fragmento al query: {', '.join(fragment_params.keys())}")
+
+    # 3. Duplicados (conservar primero) + 4. minúsculas en valores UTM
+    final_params  = {}
+    removed_dupes = []
+    norm_list     = []
+    for pair in pieces:
+        if "=" not in pair:
+            continue
+        k, v = sp(pair).split("=", 1)
+        if k in final_params:
+            removed_dupes.append(k)
+        elif k.startswith("utm_") and v != v.lower():
+            norm_list.append(k)
+            final_params[k] = v.lower()
+        else:
+            final_params[k] = v
+    if removed_dupes:
+        fixes.append(f"Duplicados eliminados: {', '.join(set(removed_dupes))}")
+    if norm_list:
+        fixes.append(f"Normalizados a minúsculas: {', '.join(norm_list)}")
+
+    # 5. UTMs del fragmento si no existen ya
+    for k, v in fragment_params.items():
+        if k not in final_params:
+            final_params[k] = v.lower()
+
+    # 6. Reconstruir (requeridos primero)
+    order = REQUIRED + OPTIONAL
+    ordered = {k: final_params[k] for k in order if k in final_params}
+    rest    = {k: v for k, v in final_params.items() if k not in ordered}
+    all_params = {**ordered, **rest}
+    fixed = urlunparse((parsed.scheme, sp(parsed.netloc), sp(parsed.path), sp(parsed.params), urlencode(all_params), ""))
+
+    # 7. Autocorregible: la URL reconstruida sería válida. Su query sale de urlencode con claves
+    #    únicas, así que basta con mirar all_params en lugar de volver a parsearla.
+    autocorregible = (fixed.lower() not in ("nan", "none", "")
+                      and parsed.scheme.startswith("http")
+                      and " " not in fixed
+                      and all(p in all_params and all_params[p].strip() for p in REQUIRED))
+    if not autocorregible:
+        missing = [p for p in REQUIRED if p not in all_params]
+        fixes.append(f"No autocorregible — faltan: {', '.join(missing)}")
+
+    return {"errors": errors, "warnings": warnings, "params": params, "valid": len(errors) == 0, "score": score,
+            "fixed_url": fixed, "fixes": fixes, "autocorregible": autocorregible}
+
+
+# ── Taxonomía de errores y avisos ─────────────────────────────────
+# Cada diagnóstico es un bit de un uint16. El orden de los bits es el orden en que audit_url
+# emite los mensajes (para un mismo parámetro solo puede darse "Falta" o "vacío"), así que
+# recorrer los bits de menor a mayor reproduce exactamente los textos de siempre.
+
+ISSUES = [
+    ("error", "URL vacía o nula"),
+    ("error", "Sin esquema http(s)"),
+    ("error", "Contiene espacios"),
+    *[issue for p in REQUIRED for issue in (("error", f"Falta {p}"), ("error", f"{p} vacío"))],
+    *[("aviso", f"{p} presente pero vacío") for p in OPTIONAL],
+    ("aviso", "Parámetros duplicados"),
+    ("aviso", "UTMs en fragmento # — Analytics no los recoge"),
+]
+ISSUE_BIT    = {msg: 1 << i for i, (_, msg) in enumerate(ISSUES)}
+ERROR_MASK   = sum(1 << i for i, (kind, _) in enumerate(ISSUES) if kind == "error")
+WARNING_MASK = sum(1 << i for i, (kind, _) in enumerate(ISSUES) if kind == "aviso")
+DUPLICATES   = ISSUE_BIT["Parámetros duplicados"]
+
+def issue_mask(errors, warnings) -> int:
+    """Máscara de bits de las listas de mensajes de audit_url / validate_url."""
+    mask = 0
+    for msg in errors + warnings:
+        mask |= DUPLICATES if msg.startswith("Parámetros duplicados") else ISSUE_BIT[msg]
+    return mask
+
+def issue_messages(mask, duplicados="", kind="error"):
+    """Mensajes (en español) de una máscara; los duplicados llevan los nombres de los parámetros."""
+    msgs = []
+    for i, (k, msg) in enumerate(ISSUES):
+        if k == kind and mask >> i & 1:
+            msgs.append(f"{msg}: {duplicados}" if (1 << i) == DUPLICATES else msg)
+    return msgs
+
+def issue_counts(codes) -> np.ndarray:
+    """Apariciones de cada diagnóstico (array de len(ISSUES)): una reducción sobre las máscaras."""
+    codes = np.asarray(codes, dtype=np.uint16)
+    return np.array([np.count_nonzero(codes & (1 << i)) for i in range(len(ISSUES))], dtype=np.int64)
+
+def counts_to_errors(counts) -> Counter:
+    """Counter mensaje → frecuencia de los errores (no avisos) con alguna aparición."""
+    return Counter({msg: int(n) for (kind, msg), n in zip(ISSUES, counts) if kind == "error" and n})
+
+
+# ── Auditoría por lotes ───────────────────────────────────────────
+# Los diagnósticos se guardan como códigos ("codigos", máscara uint16) y los nombres de parámetros
+# duplicados ("duplicados"). Los textos de errores y avisos se generan solo al mostrar o exportar.
+# El resto también va en tipos compactos: autocorregible bool, score int8, estado categórico
+# (códigos int8), los textos que se repiten (valores UTM, correcciones) como categorías y las URLs
+# en "string[pyarrow]" (un único buffer con offsets, sin un objeto Python por celda; explícito para
+# no depender del tipo de texto por defecto de cada versión de pandas).
+
+RESULT_COLUMNS = ["url_original", "url_corregida", "autocorregible", "estado", "score",
+                  "correcciones", "codigos", "duplicados", *REQUIRED, *OPTIONAL]
+EXPORT_COLUMNS = ["url_original", "url_corregida", "autocorregible", "estado", "score",
+                  "correcciones", "errores", "avisos", *REQUIRED, *OPTIONAL]
+
+ESTADOS = pd.CategoricalDtype(["OK", "Aviso", "Error"])
+RESULT_DTYPES = {
+    "url_original": "string[pyarrow]", "url_corregida": "string[pyarrow]", "autocorregible": bool, "estado": ESTADOS,
+    "score": np.int8, "codigos": np.uint16,
+    **{c: "category" for c in ["correcciones", "duplicados", *REQUIRED, *OPTIONAL]},
+}
+
+def audit_row(url) -> dict:
+    """Fila de la tabla de auditoría para una URL (ruta fila a fila)."""
+    r = audit_url(str(url))
+    if r["valid"]:
+        estado = "OK"
+    elif r["warnings"] and not r["errors"]:
+        estado = "Aviso"
+    else:
+        estado = "Error"
+    return {
+        "url_original":   str(url),
+        "url_corregida":  r["fixed_url"],
+        "autocorregible": r["autocorregible"],
+        "estado":         estado,
+        "score":          r["score"],
+        "correcciones":   "; ".join(r["fixes"])    if r["fixes"]    else "—",
+        "codigos":        issue_mask(r["errors"], r["warnings"]),
+        "duplicados":     next((w.split(": ", 1)[1] for w in r["warnings"] if w.startswith("Parámetros duplicados")), ""),
+        **{p: r["params"].get(p, "") for p in REQUIRED + OPTIONAL},
+    }
+
+# URLs "normales": http(s) en minúsculas, sin espacios ni fragmento, y claves/valores del query
+# con caracteres que urlencode deja intactos. Para ellas el diagnóstico se calcula por columnas.
+_FAST_URL = r"(https?://[A-Za-z0-9.\-:]+(?:/[A-Za-z0-9._~\-/]*)?)(?:\?([A-Za-z0-9._~\-=&]*))?"
+
+def _join(parts, sep):
+    """Une por filas columnas de texto, saltando las vacías (equivale a sep.join de una lista)."""
+    out = np.asarray(parts[0], dtype=object)
+    for p in parts[1:]:
+        p   = np.asarray(p, dtype=object)
+        out = np.where((out != "") & (p != ""), out + sep + p, out + p)
+    return out
+
+def _group_join(values, rows, sep):
+    """
+    sep.join de los valores de cada fila, en su orden. En vez de un groupby con join por grupo
+    (una llamada Python por fila) se une por posición: el elemento 0 de todas las filas, el 1...
+    """
+    if values.empty:
+        return np.full(len(rows), "", dtype=object)
+    pos = values.groupby(level=0).cumcount().to_numpy()
+    return _join([values[pos == j].reindex(rows).fillna("").to_numpy(dtype=object)
+                  for j in range(pos.max() + 1)], sep)
+
+def _audit_fast(raw):
+    """
+    Auditoría vectorizada de URLs que ya cumplen _FAST_URL. Devuelve (DataFrame, índices a
+    reprocesar fila a fila): duplicados, pares sin '=' o valores con '=' van a la ruta normal.
+    """
+    if raw.empty:
+        return pd.DataFrame(columns=RESULT_COLUMNS), raw.index
+    parts = raw.str.extract(f"^{_FAST_URL}$")
+    base  = parts[0]
+    pairs = parts[1].fillna("").str.split("&").explode()
+    pairs = pairs[pairs != ""].astype(str)
+    keys  = pairs.str.replace(r"=.*$", "", regex=True)
+    vals  = pairs.str.replace(r"^[^=]*=?", "", regex=True)
+
+    dup  = pd.DataFrame({"row": pairs.index, "key": keys.values}).duplicated().to_numpy()
+    slow = pairs.index[(pairs.str.count("=") != 1).to_numpy() | dup].unique()
+    ok   = ~pairs.index.isin(slow)
+    keys, vals = keys[ok], vals[ok]
+    rows = raw.index.difference(slow)
+
+    n = len(rows)
+    first = {f: vals[keys == f].reindex(rows) for f in REQUIRED + OPTIONAL}
+
+    # Diagnóstico (como bits; aquí no hay duplicados ni fragmentos, van por la ruta normal)
+    err_bits, warn_bits = [], []
+    for f in REQUIRED:
+        v = first[f]
+        err_bits.append(np.where(v.isna(), ISSUE_BIT[f"Falta {f}"],
+                                 np.where(v.fillna("").str.strip() == "", ISSUE_BIT[f"{f} vacío"], 0)))
+    for f in OPTIONAL:
+        v = first[f]
+        warn_bits.append(np.where(v.notna() & (v.fillna("").str.strip() == ""), ISSUE_BIT[f"{f} presente pero vacío"], 0))
+    n_err  = sum((b != 0).astype(int) for b in err_bits) if err_bits else np.zeros(n, int)
+    n_warn = sum((b != 0).astype(int) for b in warn_bits)
+    codes  = np.bitwise_or.reduce(err_bits + warn_bits).astype(np.uint16)
+    score  = np.maximum(0, 100 - n_err * 25 - n_warn * 10)
+
+    # Corrección: minúsculas en valores utm_*, requeridos primero, resto en su orden
+    is_utm  = keys.str.startswith("utm_")
+    lowered = vals.str.lower()
+    norm    = _group_join(keys[is_utm & (vals != lowered)], rows, ", ")
+    norm    = np.where(norm == "", "", "Normalizados a minúsculas: " + norm)
+
+    order = {f: i for i, f in enumerate(REQUIRED + OPTIONAL)}
+    rank  = keys.map(order).astype(float).fillna(len(order) + keys.groupby(level=0).cumcount())
+    qdf   = pd.DataFrame({"row": keys.index, "rank": rank.values,
+                          "pair": (keys + "=" + vals.where(~is_utm, lowered)).values})
+    qdf   = qdf.sort_values(["row", "rank"], kind="stable")
+    query = _group_join(pd.Series(qdf["pair"].to_numpy(), index=qdf["row"].to_numpy()), rows, "&")
+    base  = base[rows].to_numpy(dtype=object)
+    fixed = np.where(query != "", base + "?" + query, base)
+
+    present = [first[f].notna().to_numpy() for f in REQUIRED]
+    filled  = [(first[f].fillna("").str.strip() != "").to_numpy() for f in REQUIRED]
+    auto    = np.logical_and.reduce(filled)
+    missing = _join([np.where(pr, "", f) for f, pr in zip(REQUIRED, present)], ", ")
+    not_auto = np.where(auto, "", "No autocorregible — faltan: " + missing)
+    fixes   = _join([norm, not_auto], "; ")
+
+    out = pd.DataFrame({
+        "url_original":   raw[rows].to_numpy(),
+        "url_corregida":  fixed,
+        "autocorregible": auto,
+        "estado":         np.where(n_err == 0, "OK", "Error"),
+        "score":          score,
+        "correcciones":   np.where(fixes == "", "—", fixes),
+        "codigos":        codes,
+        "duplicados":     "",
+        **{f: first[f].fillna("").to_numpy() for f in REQUIRED + OPTIONAL},
+    }, index=rows)
+    return out, slow
+
+def _audit_distinct(urls: pd.Series) -> pd.DataFrame:
+    """
+    Auditoría por columnas de una serie de URLs. Las URLs normales se validan con operaciones de texto
+    vectorizadas; las patológicas (espacios, fragmentos, codificación %, duplicados...) pasan
+    por audit_row. El resultado es idéntico al de audit_row fila a fila y conserva el orden.
+    """
+    originals = urls.map(str).reset_index(drop=True)
+    stripped  = originals.str.strip()
+    fast_mask = stripped.str.fullmatch(_FAST_URL).fillna(False).astype(bool) & (stripped == originals)
+    fast, slow = _audit_fast(stripped[fast_mask])
+    slow = originals.index[~fast_mask].union(slow)
+    slow_df = pd.DataFrame([audit_row(originals[i]) for i in slow], index=slow, columns=RESULT_COLUMNS)
+    if fast.empty:       # sin filas rápidas: el marco vacío convertiría score a object al concatenar
+        out = slow_df
+    else:
+        out = pd.concat([fast, slow_df]) if len(slow_df) else fast
+    return out.sort_index()[RESULT_COLUMNS].reset_index(drop=True)
+
+def _compact(result_df) -> pd.DataFrame:
+    """Pasa el resultado a RESULT_DTYPES. Se aplica sobre las URLs distintas, antes de replicarlas."""
+    return result_df.astype(RESULT_DTYPES)
+
+def _dedupe(urls: pd.Series):
+    """(códigos por fila, URLs distintas en orden de primera aparición)."""
+    codes, uniques = pd.factorize(urls.map(str), sort=False)
+    return codes, pd.Series(uniques, dtype=object)
+
+def audit_frame(urls: pd.Series) -> pd.DataFrame:
+    """
+    Auditoría de una columna completa: cada URL distinta se audita una sola vez y el
+    resultado se replica en todas sus filas (los exports de anuncios repiten la misma URL miles de veces).
+    """
+    codes, uniques = _dedupe(urls)
+    return _compact(_audit_distinct(uniques)).take(codes).reset_index(drop=True)
+
+AUDIT_CHUNK = 20_000
+
+def audit_frame_parallel(urls: pd.Series, pool=None, chunk_size=AUDIT_CHUNK, on_progress=None) -> pd.DataFrame:
+    """
+    audit_frame con las URLs distintas repartidas en bloques sobre un pool de procesos. Los resultados
+    se reensamblan en el orden original; on_progress(hechos, total) se llama al terminar cada bloque.
+    Con un solo bloque (o sin pool) se audita en el proceso actual.
+    """
+    codes, uniques = _dedupe(urls)
+    starts = range(0, len(uniques), chunk_size)
+    if pool is None or len(starts) <= 1:
+        return _compact(_audit_distinct(uniques)).take(codes).reset_index(drop=True)
+
+    futures = {pool.submit(_audit_distinct, uniques.iloc[i:i + chunk_size]): n for n, i in enumerate(starts)}
+    parts   = [None] * len(futures)
+    for done, fut in enumerate(as_completed(futures), start=1):
+        parts[futures[fut]] = fut.result()
+        if on_progress:
+            on_progress(done, len(parts))
+    return _compact(pd.concat(parts, ignore_index=True)).take(codes).reset_index(drop=True)
+
+def unique_urls(result_df) -> pd.DataFrame:
+    """Una fila por URL distinta con su número de apariciones, de la más repetida a la menos."""
+    codes, _ = pd.factorize(result_df["url_original"], sort=False)
+    first    = np.unique(codes, return_index=True)[1]
+    out      = result_df.iloc[first].reset_index(drop=True)
+    out.insert(0, "apariciones", np.bincount(codes))
+    return out.sort_values("apariciones", ascending=False, kind="stable").reset_index(drop=True)
+
+def error_counts(result_df) -> Counter:
+    """Frecuencia de cada error, contada sobre las máscaras de la columna 'codigos'."""
+    return counts_to_errors(issue_counts(result_df["codigos"]))
+
+def with_messages(result_df) -> pd.DataFrame:
+    """
+    Resultado en texto para mostrar o exportar: errores y avisos en lugar de 'codigos' y 'duplicados'
+    (mismas posiciones, como en EXPORT_COLUMNS), autocorregible como "Sí"/"No" y las categorías como
+    texto normal (así todos los bloques de un export tienen el mismo esquema). Las máscaras distintas
+    son pocas: cada una se traduce una vez y se replica por filas.
+    """
+    codes = result_df["codigos"].to_numpy()
+    uniq, inv = np.unique(codes, return_inverse=True)
+    texts = {}
+    for kind in ("error", "aviso"):
+        table = np.array(["; ".join(issue_messages(m, "{}", kind)) or "—" for m in uniq], dtype=object)
+        texts[kind] = table[inv.reshape(-1)]
+    # Solo los avisos de duplicados dependen de la fila: se rellenan con sus nombres
+    dup = (codes & DUPLICATES) != 0
+    if dup.any():
+        names = result_df["duplicados"].to_numpy()[dup]
+        texts["aviso"][dup] = [a.replace("{}", d, 1) for a, d in zip(texts["aviso"][dup], names)]
+    categories = {c: result_df[c].astype("str") for c in result_df.columns
+                  if isinstance(result_df[c].dtype, pd.CategoricalDtype)}
+    return (result_df.assign(**{**categories, "codigos": texts["error"], "duplicados": texts["aviso"],
+                                "autocorregible": np.where(result_df["autocorregible"].to_numpy(), "Sí", "No")})
+                     .rename(columns={"codigos": "errores", "duplicados": "avisos"}))
+
+
+# ── Reauditoría incremental ───────────────────────────────────────
+# La misma hoja se vuelve a subir tras corregir unas pocas filas: solo se auditan las URLs
+# que no estaban en la versión anterior y se informa de qué filas cambiaron de estado.
+
+def url_hashes(urls) -> np.ndarray:
+    """Hash uint64 de cada URL (como texto)."""
+    return pd.util.hash_pandas_object(pd.Series(urls, dtype=object).map(str), index=False).to_numpy()
+
+class AuditSnapshot:
+    """
+    Lo que se recuerda de una auditoría para la siguiente versión del archivo: el resultado por
+    URL distinta con su hash y, por fila, el hash de la URL y si era un error.
+    """
+
+    def __init__(self, distinct, keys, row_keys, row_errors):
+        self.distinct   = distinct     # resultado compacto, una fila por URL distinta
+        self.keys       = keys         # hash de cada URL distinta
+        self.row_keys   = row_keys
+        self.row_errors = row_errors
+
+    @property
+    def nbytes(self):
+        return (int(self.distinct.memory_usage(deep=True).sum()) + self.keys.nbytes
+                + self.row_keys.nbytes + self.row_errors.nbytes)
+
+def audit_changes(previous, snapshot) -> dict:
+    """
+    Cambios entre dos versiones de la misma hoja, por hash de URL: borrar o reordenar filas no
+    cambia nada. Una URL ya vista compara su estado anterior con el actual; una URL nueva hereda el
+    estado de la URL a la que sustituye en su misma posición si esa URL ya no aparece (fila corregida
+    in situ) y, si no, cuenta como antes correcta. La posición solo sirve para esa atribución.
+    """
+    now_estado = np.asarray(snapshot.distinct["estado"], dtype=object)[
+        pd.Index(snapshot.keys).get_indexer(snapshot.row_keys)]
+    seen_at  = pd.Index(previous.keys).get_indexer(snapshot.row_keys)
+    seen     = seen_at >= 0
+    was_estado = np.where(seen, np.asarray(previous.distinct["estado"], dtype=object)[seen_at], None)
+
+    n, m     = len(snapshot.row_keys), min(len(snapshot.row_keys), len(previous.row_keys))
+    gone     = ~np.isin(previous.row_keys, snapshot.keys)      # filas anteriores cuya URL ya no está
+    replaced = np.zeros(n, dtype=bool)
+    replaced[:m] = previous.row_errors[:m] & gone[:m]
+    was = np.where(seen, was_estado == "Error", replaced)
+    now = snapshot.row_errors
+    return {
+        "nuevos_errores": np.flatnonzero(now & ~was),   # posiciones en el resultado
+        "corregidas":     np.flatnonzero(~now & was),
+        "sin_cambios":    int((seen & (was_estado == now_estado)).sum()),
+        "nuevas":         int((~seen).sum()),           # filas con una URL que no estaba
+        "eliminadas":     int(gone.sum()),              # filas anteriores cuya URL ya no aparece
+    }
+
+def audit_incremental(urls: pd.Series, previous=None, pool=None, on_progress=None):
+    """
+    audit_frame_parallel reutilizando la auditoría anterior del mismo archivo: las URLs distintas ya
+    auditadas (mismo hash) se toman de `previous` y solo las nuevas pasan por el pool.
+    Devuelve (result_df, snapshot para la próxima versión, cambios o None si no hay anterior).
+    """
+    codes, uniques = _dedupe(urls)
+    keys  = url_hashes(uniques)
+    known = pd.Index(previous.keys).get_indexer(keys) if previous is not None else np.full(len(keys), -1)
+    new   = known < 0
+
+    parts = []
+    if new.any():
+        fresh = audit_frame_parallel(uniques[new], pool, on_progress=on_progress)
+        parts.append(fresh.set_axis(np.flatnonzero(new)))
+    if not new.all():
+        parts.append(previous.distinct.take(known[~new]).set_axis(np.flatnonzero(~new)))
+    if not parts:
+        parts.append(_compact(pd.DataFrame(columns=RESULT_COLUMNS)))
+    # Cada parte trae sus propias categorías: al unirlas se vuelve a compactar
+    distinct = parts[0] if len(parts) == 1 else _compact(pd.concat(parts).sort_index())
+
+    result_df  = distinct.take(codes).reset_index(drop=True)
+    row_errors = (result_df["estado"] == "Error").to_numpy()
+    snapshot   = AuditSnapshot(distinct.reset_index(drop=True), keys, keys[codes], row_errors)
+    changes    = audit_changes(previous, snapshot) if previous is not None else None
+    if changes is not None:
+        changes["reauditadas"] = int(new.sum())
+    return result_df, snapshot, changes
+
+
+# ── Auditoría en streaming ────────────────────────────────────────
+
+STREAM_CHUNK = 200_000   # filas leídas del CSV por bloque
+
+class AuditTotals:
+    """Agregados de una auditoría en streaming: es lo único que queda en memoria."""
+
+    def __init__(self):
+        self.total     = 0
+        self.estados   = Counter()
+        self.score_sum = 0
+        self.n_fixed   = 0
+        self.issues    = np.zeros(len(ISSUES), dtype=np.int64)   # apariciones por código
+
+    def add(self, result_df):
+        self.total     += len(result_df)
+        estados = result_df["estado"].value_counts()
+        self.estados.update(estados[estados > 0].to_dict())
+        self.score_sum += int(result_df["score"].sum())
+        self.n_fixed   += int(result_df["autocorregible"].sum())
+        self.issues    += issue_counts(result_df["codigos"])
+
+    @property
+    def errors(self):
+        return counts_to_errors(self.issues)
+
+    @property
+    def avg_score(self):
+        return int(self.score_sum / self.total) if self.total else 0
+
+def read_url_chunks(source, chunk_size=STREAM_CHUNK):
+    """Lee solo la columna 'url' de un CSV, por bloques."""
+    return pd.read_csv(source, usecols=lambda c: c == "url", chunksize=chunk_size)
+
+def audit_stream(chunks, totals, pool=None, on_chunk=None):
+    """
+    Audita los bloques uno a uno y los devuelve, ya con los textos de errores y avisos
+    (EXPORT_COLUMNS), para escribirlos a disco según llegan (p. ej. con los exportadores
+    de bulk_engine). Solo `totals` crece con el archivo.
+    on_chunk(totals) se llama tras cada bloque.
+    """
+    for chunk in chunks:
+        if "url" not in chunk.columns:
+            raise ValueError("El archivo debe contener una columna llamada 'url'.")
+        result = audit_frame_parallel(chunk["url"], pool)
+        totals.add(result)
+        if on_chunk:
+            on_chunk(totals)
+        yield with_messages(result)
+
+
+# ── Estimación por muestreo ───────────────────────────────────────
+# Antes de auditar un export de millones de filas: se valida una muestra aleatoria tomada en una
+# sola pasada y se estiman las tasas de cada estado y diagnóstico con su intervalo de confianza.
+
+SAMPLE_SIZE = 20_000
+
+def reservoir_sample(chunks, k=SAMPLE_SIZE, seed=None):
+    """
+    Muestra aleatoria uniforme de k URLs en una sola pasada por los bloques (algoritmo R,
+    vectorizado por bloque). Devuelve (muestra, filas leídas).
+    """
+    rng       = np.random.default_rng(seed)
+    reservoir = np.empty(k, dtype=object)
+    seen      = 0
+    for chunk in chunks:
+        if "url" not in chunk.columns:
+            raise ValueError("El archivo debe contener una columna llamada 'url'.")
+        values = chunk["url"].to_numpy(dtype=object)
+        fill   = min(max(k - seen, 0), len(values))
+        reservoir[seen:seen + fill] = values[:fill]
+        rest = values[fill:]
+        if len(rest):
+            # La fila i-ésima (global) entra con probabilidad k/(i+1) y sustituye a una al azar;
+            # con posiciones repetidas gana la última fila, igual que en el algoritmo secuencial
+            slot = rng.integers(0, seen + fill + np.arange(len(rest)) + 1)
+            keep = slot < k
+            reservoir[slot[keep]] = rest[keep]
+        seen += len(values)
+    return pd.Series(reservoir[:min(seen, k)], dtype=object), seen
+
+def _wilson(hits, n, z):
+    """Intervalo de Wilson para una proporción (hits puede ser un array)."""
+    p      = np.asarray(hits, dtype=float) / n
+    denom  = 1 + z**2 / n
+    center = (p + z**2 / (2 * n)) / denom
+    half   = z * np.sqrt(p * (1 - p) / n + z**2 / (4 * n**2)) / denom
+    return np.clip(center - half, 0, 1), np.clip(center + half, 0, 1)
+
+def estimate_audit(sample: pd.Series, total, confidence=0.95) -> dict:
+    """
+    Estimación de la auditoría de `total` filas a partir de una muestra aleatoria: tasa de cada estado y
+    de cada diagnóstico observado (intervalo de Wilson), filas estimadas y score medio (intervalo normal).
+    Se aplica la corrección por población finita: si la muestra es el archivo entero, los intervalos se cierran.
+    """
+    result = audit_frame(sample)
+    n = len(result)
+    if n == 0:
+        return {"total": total, "muestra": 0, "confianza": confidence, "estados": None, "diagnosticos": None, "score": None}
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    z *= np.sqrt((total - n) / (total - 1)) if total > 1 else 0.0
+
+    def rates(labels, hits):
+        lo, hi = _wilson(hits, n, z)
+        return pd.DataFrame({"diagnostico": labels, "muestra": hits, "tasa": np.asarray(hits) / n,
+                             "ic_inf": lo, "ic_sup": hi, "filas_estimadas": np.rint(np.asarray(hits) / n * total).astype(int)})
+
+    estados = result["estado"].value_counts().reindex(ESTADOS.categories, fill_value=0)
+    issues  = issue_counts(result["codigos"])
+    seen    = [i for i, c in enumerate(issues) if c]
+    diag    = rates([ISSUES[i][1] for i in seen], issues[seen])
+    diag.insert(0, "tipo", [ISSUES[i][0] for i in seen])
+    scores  = result["score"].to_numpy(dtype=float)
+    half    = z * scores.std(ddof=1) / np.sqrt(n) if n > 1 else 0.0
+    return {
+        "total":        total,
+        "muestra":      n,
+        "confianza":    confidence,
+        "estados":      rates(list(estados.index), estados.to_numpy()),
+        "diagnosticos": diag.sort_values("tasa", ascending=False, kind="stable").reset_index(drop=True),
+        "score":        (scores.mean(), max(scores.mean() - half, 0.0), min(scores.mean() + half, 100.0)),
+    }
+
+
+# ── Benchmark ─────────────────────────────────────────────────────
+# python audit_engine.py  → compara validate_url + fix_url con audit_url y con audit_frame
+
+SAMPLE_URLS = [
+    "https://tusitio.com?utm_source=google&utm_medium=cpc&utm_campaign=black_friday",
+    "https://tusitio.com/landing?utm_source=Facebook&utm_medium=Social&utm_campaign=Lanzamiento&utm_content=banner_azul",
+    "https://tusitio.com?utm_source=newsletter&utm_medium=email&utm_source=newsletter&utm_campaign=abril",
+    "https://tusitio.com/ofertas#utm_source=google&utm_medium=cpc&utm_campaign=rebajas",
+    "https://tusitio.com/mi landing?utm_source=google&utm_medium=cpc",
+    "tusitio.com?utm_medium=display&utm_campaign=verano&utm_term=",
+]
+
+def benchmark(n=200_000):
+    # Mezcla realista: la mayoría de URLs bien formadas y una de cada diez con algún problema
+    urls = [SAMPLE_URLS[i % len(SAMPLE_URLS)] if i % 10 == 0 else
+            f"https://tusitio.com/p?utm_source=Google&utm_medium=cpc&utm_campaign=c{i % 50}&ref={i}"
+            for i in range(n)]
+
+    t0 = time.perf_counter()
+    ref = [{**validate_url(u), **fix_url(u)} for u in urls]
+    t_ref = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    fused = [audit_url(u) for u in urls]
+    t_fused = time.perf_counter() - t0
+
+    assert ref == fused, "audit_url difiere de validate_url + fix_url"
+    print(f"{n} URLs · validate+fix {t_ref:.2f}s · fusionado {t_fused:.2f}s · x{t_ref / t_fused:.1f}")
+
+    t0 = time.perf_counter()
+    rows = _compact(pd.DataFrame([audit_row(u) for u in urls], columns=RESULT_COLUMNS))
+    t_rows = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    batch = audit_frame(pd.Series(urls))
+    t_batch = time.perf_counter() - t0
+
+    assert rows.equals(batch), "audit_frame difiere de audit_row fila a fila"
+    print(f"{n} URLs · tabla fila a fila {t_rows:.2f}s · por lotes {t_batch:.2f}s · x{t_rows / t_batch:.1f}")
+
+    # Export de anuncios: una fila por anuncio, pocas URLs de tracking distintas
+    ads = pd.Series([urls[i % (n // 100)] for i in range(n)])
+    t0 = time.perf_counter()
+    every = _compact(_audit_distinct(ads))
+    t_every = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    deduped = audit_frame(ads)
+    t_dedup = time.perf_counter() - t0
+
+    assert every.equals(deduped), "audit_frame con deduplicación difiere de auditar cada fila"
+    print(f"{n} filas / {n // 100} URLs distintas · sin deduplicar {t_every:.2f}s · deduplicado {t_dedup:.2f}s · x{t_every / t_dedup:.1f}")
+
+    # Misma hoja subida de nuevo con 50 filas corregidas: solo se auditan las URLs nuevas
+    _, snapshot, _ = audit_incremental(pd.Series(urls))
+    edited = list(urls)
+    for i in range(0, n, n // 50):
+        edited[i] = f"https://tusitio.com/p?utm_source=google&utm_medium=cpc&utm_campaign=fix{i}"
+    t0 = time.perf_counter()
+    full = audit_frame(pd.Series(edited))
+    t_full = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    incr, _, changes = audit_incremental(pd.Series(edited), snapshot)
+    t_incr = time.perf_counter() - t0
+
+    assert full.astype(str).equals(incr.astype(str)), "la reauditoría incremental difiere de auditar de nuevo"
+    print(f"{n} filas / {changes['nuevas']} cambiadas · reauditar todo {t_full:.2f}s · incremental {t_incr:.2f}s · x{t_full / t_incr:.1f}")
+
+    # Estimación por muestreo frente a la auditoría completa (batch, de más arriba)
+    t0 = time.perf_counter()
+    sample, seen = reservoir_sample(pd.read_csv(io.StringIO("url\n" + "\n".join(urls)), chunksize=STREAM_CHUNK // 4),
+                                    k=n // 20, seed=0)
+    est = estimate_audit(sample, seen)
+    t_est = time.perf_counter() - t0
+
+    exact = issue_counts(batch["codigos"]) / n
+    diag  = est["diagnosticos"]
+    rate  = {msg: exact[i] for i, (_, msg) in enumerate(ISSUES)}
+    inside = sum(lo <= rate[m] <= hi for m, lo, hi in zip(diag["diagnostico"], diag["ic_inf"], diag["ic_sup"]))
+    print(f"{n} filas · muestra {est['muestra']} · estimación {t_est:.2f}s · {inside}/{len(diag)} tasas exactas dentro del IC 95%")
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,369 @@
+# audit_report.py
+# Reporte Excel de la auditoría por archivo (resumen, auditoría completa, errores y URLs corregidas)
+
+from datetime import datetime
+from io import BytesIO
+import tempfile, time, warnings
+import xlsxwriter
+from xlsxwriter.utility import xl_col_to_name
+from audit_engine import with_messages
+
+RENDER_CHUNK = 50_000   # filas cuyos textos de errores y avisos se generan de una vez
+
+# Columnas de las hojas de detalle: (columna del resultado, cabecera, ancho)
+DETAIL_COLUMNS = [
+    ("estado",         "Estado",                 10),
+    ("score",          "Score",                   8),
+    ("url_original",   "URL original",           55),
+    ("url_corregida",  "URL corregida",          55),
+    ("autocorregible", "Autocorregible",         14),
+    ("correcciones",   "Correcciones aplicadas", 45),
+    ("errores",        "Errores",                40),
+    ("avisos",         "Avisos",                 35),
+    ("utm_source",     "utm_source",             16),
+    ("utm_medium",     "utm_medium",             14),
+    ("utm_campaign",   "utm_campaign",           24),
+    ("utm_content",    "utm_content",            16),
+    ("utm_term",       "utm_term",               16),
+]
+UNIQUE_COLUMNS = [
+    ("apariciones",    "Apariciones",            12),
+    ("estado",         "Estado",                 10),
+    ("score",          "Score",                   8),
+    ("url_original",   "URL original",           55),
+    ("url_corregida",  "URL corregida",          55),
+    ("autocorregible", "Autocorregible",         14),
+    ("errores",        "Errores",                40),
+]
+FIXED_COLUMNS = [
+    ("url_corregida",  "URL corregida",          70),
+    ("autocorregible", "Autocorregible",         14),
+    ("estado",         "Estado original",        12),
+    ("correcciones",   "Correcciones aplicadas", 50),
+    ("utm_source",     "utm_source",             18),
+    ("utm_medium",     "utm_medium",             14),
+    ("utm_campaign",   "utm_campaign",           26),
+]
+
+
+def _formats(wb):
+    """Conjunto fijo de formatos del reporte; se crean una sola vez por libro."""
+    def fmt(**kw):
+        base = {"font_name": "Arial", "font_size": 8, "valign": "vcenter"}
+        base.update(kw)
+        return wb.add_format(base)
+
+    cell = {"border": 1, "border_color": "#E4E4E7"}
+    return {
+        "title":   fmt(font_size=14, bold=True, font_color="#1A1A1A"),
+        "meta":    fmt(font_size=9, font_color="#71717A"),
+        "section": fmt(bold=True, font_color="#3D5A80"),
+        "hdr":     fmt(bold=True, font_color="#FFFFFF", bg_color="#3D5A80",
+                       border=1, border_color="#2e4460", align="center", text_wrap=True),
+        "center":  fmt(bold=True, align="center", **cell),
+        "cell":    fmt(**cell),
+        "mono":    fmt(font_name="Courier New", font_color="#3D5A80", **cell),
+        # Resumen: filas alternas
+        "label":   [fmt(bg_color=bg, **cell) for bg in ("#FAFAFA", "#FFFFFF")],
+        "value":   [fmt(bold=True, align="center", bg_color=bg, **cell) for bg in ("#FAFAFA", "#FFFFFF")],
+        "e_label": [fmt(bg_color=bg, **cell) for bg in ("#FFF8F8", "#FFFFFF")],
+        "e_value": [fmt(bold=True, font_color="#E11D48", align="center", bg_color=bg, **cell) for bg in ("#FFF8F8", "#FFFFFF")],
+        # Formatos condicionales (solo color, borde y fondo: lo que Excel permite en ellos)
+        "c_ok":    wb.add_format({"font_color": "#166534", "bg_color": "#DCFCE7"}),
+        "c_warn":  wb.add_format({"font_color": "#92400E", "bg_color": "#FEF9C3"}),
+        "c_err":   wb.add_format({"font_color": "#9F1239", "bg_color": "#FFE4E6"}),
+        "c_sc_ok": wb.add_format({"font_color": "#16a34a"}),
+        "c_sc_w":  wb.add_format({"font_color": "#92400E"}),
+        "c_sc_e":  wb.add_format({"font_color": "#E11D48"}),
+        "c_fixed": wb.add_format({"font_color": "#16a34a", "bg_color": "#F0FDF4"}),
+        "c_fix_l": wb.add_format({"font_color": "#166534", "bg_color": "#F0FDF4"}),
+    }
+
+
+# Formato base por columna (set_column): xlsxwriter lo aplica a las celdas escritas sin formato
+_COLUMN_FORMAT = {"apariciones": "center", "estado": "center", "score": "center", "url_original": "mono", "url_corregida": "mono",
+                  "utm_source": "mono", "utm_medium": "mono", "utm_campaign": "mono",
+                  "utm_content": "mono", "utm_term": "mono"}
+
+def _detail_sheet(wb, f, name, tab, columns, df):
+    """
+    Hoja de detalle escrita fila a fila en modo constant_memory: una llamada a write_row por fila,
+    con el formato heredado de la columna. Los colores por estado, score y autocorrección
+    se aplican con formato condicional sobre rangos enteros.
+    """
+    ws = wb.add_worksheet(name)
+    ws.set_tab_color(tab)
+    ws.freeze_panes(1, 0)
+    ws.set_default_row(15)
+    ws.set_row(0, 26)
+    for c, (field, label, width) in enumerate(columns):
+        ws.set_column(c, c, width, f[_COLUMN_FORMAT.get(field, "cell")])
+    ws.write_row(0, 0, [label for _, label, _ in columns], f["hdr"])
+
+    names = [col for col, _, _ in columns]
+    r = 0
+    for start in range(0, len(df), RENDER_CHUNK):
+        # Los textos de errores y avisos se generan por bloques, justo antes de escribirlos
+        part = with_messages(df.iloc[start:start + RENDER_CHUNK])[names]
+        for r, values in enumerate(part.itertuples(index=False, name=None), start=r + 1):
+            ws.write_row(r, 0, values)
+
+    if r:
+        col = {field: c for c, field in enumerate(names)}
+        def cond(field, **kw):
+            if field in col:
+                ws.conditional_format(1, col[field], r, col[field], kw)
+
+        cond("estado", type="cell", criteria="==", value='"OK"',    format=f["c_ok"])
+        cond("estado", type="cell", criteria="==", value='"Aviso"', format=f["c_warn"])
+        cond("estado", type="cell", criteria="==", value='"Error"', format=f["c_err"])
+        cond("score", type="cell", criteria=">=",      value=90,                 format=f["c_sc_ok"])
+        cond("score", type="cell", criteria="between", minimum=60, maximum=89,   format=f["c_sc_w"])
+        cond("score", type="cell", criteria="<",       value=60,                 format=f["c_sc_e"])
+        cond("autocorregible", type="cell", criteria="==", value='"Sí"', format=f["c_fix_l"])
+        if "autocorregible" in col:
+            cond("url_corregida", type="formula", criteria=f'=${xl_col_to_name(col["autocorregible"])}2="Sí"', format=f["c_fixed"])
+    return ws
+
+
+def build_audit_excel(result_df, avg_score, ok, ko, avisos, n_fixed, total, all_errors, unique_df=None):
+    """
+    Reporte de auditoría en modo constant_memory: cada fila se vuelca a disco al escribirse,
+    así que la memoria no crece con el número de URLs. Con unique_df (ver audit_engine.unique_urls) se añade
+    la hoja de URLs únicas con sus apariciones. Devuelve un fichero temporal posicionado al inicio.
+    """
+    tmp = tempfile.TemporaryFile()
+    wb  = xlsxwriter.Workbook(tmp, {"constant_memory": True, "strings_to_urls": False})
+    f   = _formats(wb)
+
+    # ── Hoja 1: Resumen ejecutivo ──────────────────────────────
+    ws1 = wb.add_worksheet("Resumen")
+    ws1.set_tab_color("#3D5A80")
+    ws1.set_column("A:A", 30)
+    ws1.set_column("B:B", 18)
+
+    ws1.write("A1", "Reporte de Auditoría UTM", f["title"])
+    ws1.write("A2", f"Generado: {datetime.now().strftime('%d/%m/%Y %H:%M')}", f["meta"])
+
+    ws1.write("A4", "RESUMEN GLOBAL", f["section"])
+    summary = [
+        ("URLs analizadas",     total),
+        ("URLs correctas",      ok),
+        ("URLs con avisos",     avisos),
+        ("URLs con errores",    ko),
+        ("URLs autocorregidas", n_fixed),
+        ("Score medio",         f"{avg_score}/100"),
+        ("Tasa de error",       f"{round(ko/total*100,1)}%" if total else "0%"),
+        ("Tasa autocorrección", f"{round(n_fixed/ko*100,1)}%" if ko else "N/A"),
+    ]
+    for i, (label, val) in enumerate(summary):
+        ws1.write(5+i, 0, label, f["label"][i % 2])
+        ws1.write(5+i, 1, val,   f["value"][i % 2])
+
+    if all_errors:
+        ws1.write("A15", "ERRORES MÁS FRECUENTES", f["section"])
+        ws1.write_row("A16", ["Error", "Frecuencia"], f["hdr"])
+        for i, (err, cnt) in enumerate(all_errors.most_common(10)):
+            ws1.write(16+i, 0, err, f["e_label"][i % 2])
+            ws1.write(16+i, 1, cnt, f["e_value"][i % 2])
+
+    # ── Hojas de detalle ───────────────────────────────────────
+    _detail_sheet(wb, f, "Auditoría completa", "#3D5A80", DETAIL_COLUMNS, result_df)
+    _detail_sheet(wb, f, "Errores",            "#E11D48", DETAIL_COLUMNS, result_df[result_df["estado"] == "Error"])
+    _detail_sheet(wb, f, "URLs corregidas",    "#16a34a", FIXED_COLUMNS,  result_df)
+    if unique_df is not None:
+        _detail_sheet(wb, f, "URLs únicas",    "#71717A", UNIQUE_COLUMNS, unique_df)
+
+    wb.close()
+    tmp.seek(0)
+    return tmp
+
+
+def build_audit_excel_reference(result_df, avg_score, ok, ko, avisos, n_fixed, total, all_errors):
+    """Versión celda a celda (iterrows + un formato por celda). Se conserva como referencia para el benchmark."""
+    buf = BytesIO()
+    wb  = xlsxwriter.Workbook(buf)
+
+    # Formatos base
+    def fmt(wb, **kw):
+        base = {"font_name": "Arial", "font_size": 8, "valign": "vcenter"}
+        base.update(kw)
+        return wb.add_format(base)
+
+    f_title  = fmt(wb, font_size=14, bold=True, font_color="#1A1A1A")
+    f_meta   = fmt(wb, font_size=9, font_color="#71717A")
+    f_hdr    = fmt(wb, bold=True, font_color="#FFFFFF", bg_color="#3D5A80",
+                   border=1, border_color="#2e4460", align="center", text_wrap=True, font_size=8)
+    f_ok     = fmt(wb, bold=True, font_color="#166534", bg_color="#DCFCE7", align="center", border=1, border_color="#BBF7D0")
+    f_warn   = fmt(wb, bold=True, font_color="#92400E", bg_color="#FEF9C3", align="center", border=1, border_color="#FDE68A")
+    f_err    = fmt(wb, bold=True, font_color="#9F1239", bg_color="#FFE4E6", align="center", border=1, border_color="#FECDD3")
+    f_sc_ok  = fmt(wb, bold=True, font_color="#16a34a", align="center", border=1, border_color="#E4E4E7")
+    f_sc_w   = fmt(wb, bold=True, font_color="#92400E", align="center", border=1, border_color="#E4E4E7")
+    f_sc_e   = fmt(wb, bold=True, font_color="#E11D48", align="center", border=1, border_color="#E4E4E7")
+    f_url    = fmt(wb, font_name="Courier New", font_color="#3D5A80", border=1, border_color="#E4E4E7")
+    f_url_fix= fmt(wb, font_name="Courier New", font_color="#16a34a", border=1, border_color="#BBF7D0", bg_color="#F0FDF4")
+    f_cell   = fmt(wb, border=1, border_color="#E4E4E7")
+    f_mono   = fmt(wb, font_name="Courier New", font_color="#3D5A80", border=1, border_color="#E4E4E7")
+    f_fix_lbl= fmt(wb, font_color="#166534", bg_color="#F0FDF4", border=1, border_color="#BBF7D0")
+
+    # ── Hoja 1: Resumen ejecutivo ──────────────────────
+    ws1 = wb.add_worksheet("Resumen")
+    ws1.set_tab_color("#3D5A80")
+    ws1.set_column("A:A", 30)
+    ws1.set_column("B:B", 18)
+
+    ws1.write("A1", "Reporte de Auditoría UTM", f_title)
+    ws1.write("A2", f"Generado: {datetime.now().strftime('%d/%m/%Y %H:%M')}", f_meta)
+
+    ws1.write("A4", "RESUMEN GLOBAL", fmt(wb, font_size=8, bold=True, font_color="#3D5A80"))
+    summary = [
+        ("URLs analizadas",     total),
+        ("URLs correctas",      ok),
+        ("URLs con avisos",     avisos),
+        ("URLs con errores",    ko),
+        ("URLs autocorregidas", n_fixed),
+        ("Score medio",         f"{avg_score}/100"),
+        ("Tasa de error",       f"{round(ko/total*100,1)}%" if total else "0%"),
+        ("Tasa autocorrección", f"{round(n_fixed/ko*100,1)}%" if ko else "N/A"),
+    ]
+    for i, (label, val) in enumerate(summary):
+        bg = "#FAFAFA" if i % 2 == 0 else "#FFFFFF"
+        ws1.write(5+i, 0, label, fmt(wb, border=1, border_color="#E4E4E7", bg_color=bg))
+        ws1.write(5+i, 1, val,   fmt(wb, bold=True, align="center", border=1, border_color="#E4E4E7", bg_color=bg))
+
+    if all_errors:
+        ws1.write("A15", "ERRORES MÁS FRECUENTES", fmt(wb, font_size=8, bold=True, font_color="#3D5A80"))
+        ws1.write("A16", "Error",      f_hdr)
+        ws1.write("B16", "Frecuencia", f_hdr)
+        for i, (err, cnt) in enumerate(all_errors.most_common(10)):
+            bg = "#FFF8F8" if i % 2 == 0 else "#FFFFFF"
+            ws1.write(16+i, 0, err, fmt(wb, border=1, border_color="#E4E4E7", bg_color=bg))
+            ws1.write(16+i, 1, cnt, fmt(wb, bold=True, font_color="#E11D48", align="center", border=1, border_color="#E4E4E7", bg_color=bg))
+
+    # ── Hoja 2: Auditoría completa ─────────────────────
+    ws2 = wb.add_worksheet("Auditoría completa")
+    ws2.set_tab_color("#3D5A80")
+    ws2.freeze_panes(1, 0)
+    ws2.set_row(0, 26)
+
+    cols2   = ["Estado","Score","URL original","URL corregida","Autocorregible",
+               "Correcciones aplicadas","Errores","Avisos",
+               "utm_source","utm_medium","utm_campaign","utm_content","utm_term"]
+    widths2 = [10,8,55,55,14,45,40,35,16,14,24,16,16]
+    for c,(col,w) in enumerate(zip(cols2,widths2)):
+        ws2.write(0,c,col,f_hdr)
+        ws2.set_column(c,c,w)
+
+    for i, row in result_df.iterrows():
+        r_num = i + 1
+        ws2.set_row(r_num, 15)
+        sfmt  = f_ok if row["estado"]=="OK" else (f_warn if row["estado"]=="Aviso" else f_err)
+        scfmt = f_sc_ok if row["score"]>=90 else (f_sc_w if row["score"]>=60 else f_sc_e)
+        ufmt  = f_url_fix if row["autocorregible"]=="Sí" else f_url
+
+        ws2.write(r_num, 0,  row["estado"],        sfmt)
+        ws2.write(r_num, 1,  row["score"],         scfmt)
+        ws2.write(r_num, 2,  row["url_original"],  f_url)
+        ws2.write(r_num, 3,  row["url_corregida"], ufmt)
+        ws2.write(r_num, 4,  row["autocorregible"],f_fix_lbl if row["autocorregible"]=="Sí" else f_cell)
+        ws2.write(r_num, 5,  row["correcciones"],  f_cell)
+        ws2.write(r_num, 6,  row["errores"],       f_cell)
+        ws2.write(r_num, 7,  row["avisos"],        f_cell)
+        ws2.write(r_num, 8,  row["utm_source"],    f_mono)
+        ws2.write(r_num, 9,  row["utm_medium"],    f_mono)
+        ws2.write(r_num, 10, row["utm_campaign"],  f_mono)
+        ws2.write(r_num, 11, row["utm_content"],   f_mono)
+        ws2.write(r_num, 12, row["utm_term"],      f_mono)
+
+    # ── Hoja 3: Solo errores ───────────────────────────
+    ws3 = wb.add_worksheet("Errores")
+    ws3.set_tab_color("#E11D48")
+    ws3.freeze_panes(1, 0)
+    ws3.set_row(0, 26)
+    for c,(col,w) in enumerate(zip(cols2,widths2)):
+        ws3.write(0,c,col,f_hdr)
+        ws3.set_column(c,c,w)
+
+    err_rows = result_df[result_df["estado"]=="Error"]
+    for i,(_, row) in enumerate(err_rows.iterrows()):
+        ws3.set_row(i+1,15)
+        scfmt = f_sc_ok if row["score"]>=90 else (f_sc_w if row["score"]>=60 else f_sc_e)
+        ufmt  = f_url_fix if row["autocorregible"]=="Sí" else f_url
+        ws3.write(i+1,0,  row["estado"],        f_err)
+        ws3.write(i+1,1,  row["score"],         scfmt)
+        ws3.write(i+1,2,  row["url_original"],  f_url)
+        ws3.write(i+1,3,  row["url_corregida"], ufmt)
+        ws3.write(i+1,4,  row["autocorregible"],f_fix_lbl if row["autocorregible"]=="Sí" else f_cell)
+        ws3.write(i+1,5,  row["correcciones"],  f_cell)
+        ws3.write(i+1,6,  row["errores"],       f_cell)
+        ws3.write(i+1,7,  row["avisos"],        f_cell)
+        ws3.write(i+1,8,  row["utm_source"],    f_mono)
+        ws3.write(i+1,9,  row["utm_medium"],    f_mono)
+        ws3.write(i+1,10, row["utm_campaign"],  f_mono)
+        ws3.write(i+1,11, row["utm_content"],   f_mono)
+        ws3.write(i+1,12, row["utm_term"],      f_mono)
+
+    # ── Hoja 4: URLs corregidas listas para usar ───────
+    ws4 = wb.add_worksheet("URLs corregidas")
+    ws4.set_tab_color("#16a34a")
+    ws4.freeze_panes(1, 0)
+    ws4.set_row(0, 26)
+    cols4   = ["url_corregida","autocorregible","estado_original","correcciones","utm_source","utm_medium","utm_campaign"]
+    widths4 = [70,14,12,50,18,14,26]
+    labels4 = ["URL corregida","Autocorregible","Estado original","Correcciones aplicadas","utm_source","utm_medium","utm_campaign"]
+    for c,(col,w) in enumerate(zip(labels4,widths4)):
+        ws4.write(0,c,col,f_hdr)
+        ws4.set_column(c,c,w)
+
+    for i,(_, row) in enumerate(result_df.iterrows()):
+        ws4.set_row(i+1,15)
+        ufmt = f_url_fix if row["autocorregible"]=="Sí" else f_url
+        sfmt = f_ok if row["estado"]=="OK" else (f_warn if row["estado"]=="Aviso" else f_err)
+        ws4.write(i+1,0, row["url_corregida"],  ufmt)
+        ws4.write(i+1,1, row["autocorregible"], f_fix_lbl if row["autocorregible"]=="Sí" else f_cell)
+        ws4.write(i+1,2, row["estado"],         sfmt)
+        ws4.write(i+1,3, row["correcciones"],   f_cell)
+        ws4.write(i+1,4, row["utm_source"],     f_mono)
+        ws4.write(i+1,5, row["utm_medium"],     f_mono)
+        ws4.write(i+1,6, row["utm_campaign"],   f_mono)
+
+    wb.close()
+    buf.seek(0)
+    return buf
+
+
+# ── Benchmark ─────────────────────────────────────────────────────
+# python audit_report.py  → compara el writer celda a celda con el de constant_memory
+
+def benchmark(sizes=(10_000, 100_000, 500_000), reference_max=100_000):
+    import resource
+    import pandas as pd
+    from audit_engine import SAMPLE_URLS, audit_frame, error_counts
+
+    base = audit_frame(pd.Series(SAMPLE_URLS + [
+        f"https://tusitio.com/p?utm_source=google&utm_medium=cpc&utm_campaign=c{i}" for i in range(94)]))
+    for n in sizes:
+        df = pd.concat([base] * (n // len(base) + 1), ignore_index=True).iloc[:n]
+        args = (df, int(df["score"].mean()), (df["estado"] == "OK").sum(), (df["estado"] == "Error").sum(),
+                (df["estado"] == "Aviso").sum(), df["autocorregible"].sum(), n, error_counts(df))
+        line = f"{n:>7} filas"
+        if n <= reference_max:
+            t0 = time.perf_counter()
+            with warnings.catch_warnings():   # la referencia avisa al pasar de 65.530 hipervínculos por hoja
+                warnings.simplefilter("ignore")
+                size_ref = len(build_audit_excel_reference(with_messages(df), *args[1:]).getvalue())
+            t_ref = time.perf_counter() - t0
+            line += f" · celda a celda {t_ref:.1f}s ({size_ref / 2**20:.1f} MiB)"
+        t0 = time.perf_counter()
+        with build_audit_excel(*args) as out:
+            size = out.seek(0, 2)
+        t_new = time.perf_counter() - t0
+        line += f" · constant_memory {t_new:.1f}s ({size / 2**20:.1f} MiB)"
+        if n <= reference_max:
+            line += f" · x{t_ref / t_new:.1f}"
+        print(line)
+    print(f"RSS máx. {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024} MiB")
+
+
+if __name__ == "__main__":
+    benchmark()
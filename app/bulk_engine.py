@@ -0,0 +1,492 @@
+# bulk_engine.py
+# Motor de generación masiva de URLs UTM: combinaciones perezosas por bloques
+
+import copy, gzip, itertools, os, re, shutil, sys, tempfile, time, zipfile
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+import numpy as np
+import pandas as pd
+import xlsxwriter
+
+UTM_FIELDS = ["utm_source", "utm_medium", "utm_campaign", "utm_content", "utm_term"]
+COLUMNS    = UTM_FIELDS + ["url_final"]
+CHUNK_SIZE = 50_000
+
+# ── Generación ────────────────────────────────────────────────────
+
+def build_url(base_url, src, med, cam, con="", trm=""):
+    p = {"utm_source": src, "utm_medium": med, "utm_campaign": cam}
+    if con: p["utm_content"] = con
+    if trm: p["utm_term"]    = trm
+    return f"{base_url}?{urlencode(p)}"
+
+def iter_rows(base_url, sources, mediums, campaigns, contents, terms):
+    """Ruta de referencia fila a fila (urlencode por fila); se usa para comparar en el benchmark."""
+    for src, med, cam, con, trm in itertools.product(sources, mediums, campaigns, contents, terms):
+        yield (src, med, cam, con or "", trm or "", build_url(base_url, src, med, cam, con, trm))
+
+def encode_values(field, values, prefix="&"):
+    """
+    urlencode de cada valor distinto una sola vez por dimensión.
+    Los valores vacíos (content/term opcionales) se codifican como "" y no aparecen en la URL.
+    """
+    return np.array([f"{prefix}{urlencode({field: v})}" if v else "" for v in values], dtype=object)
+
+def compact_dtype(n):
+    """Entero más pequeño capaz de indexar n valores."""
+    for dtype in (np.int8, np.int16, np.int32):
+        if n <= np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+def categorize(values):
+    """Valores únicos (en orden de aparición) y código categórico de cada posición."""
+    pos = {}
+    for v in values:
+        pos.setdefault(v, len(pos))
+    return list(pos), np.array([pos[v] for v in values], dtype=compact_dtype(len(pos)))
+
+def decode_codes(positions, radices):
+    """Índices planos del producto -> códigos por dimensión (la última varía más rápido)."""
+    idx   = np.asarray(positions, dtype=np.int64)
+    codes = []
+    for r in reversed(radices):
+        codes.append(idx % r)
+        idx = idx // r
+    return codes[::-1]
+
+def count_combinations(dims):
+    total = 1
+    for d in dims:
+        total *= len(d)
+    return total
+
+
+# ── Reglas entre dimensiones ──────────────────────────────────────
+# Una regla por línea:
+#   medium=email -> source=newsletter, mailchimp    (email solo con esas fuentes)
+#   source=newsletter !-> medium=cpc, display       (newsletter nunca con esos medios)
+
+def _rule_side(text, line):
+    if "=" not in text:
+        raise ValueError(f"Regla no válida: '{line}'. Formato: medium=email -> source=newsletter")
+    field, values = text.split("=", 1)
+    field = field.strip().lower()
+    field = field if field.startswith("utm_") else f"utm_{field}"
+    if field not in UTM_FIELDS:
+        raise ValueError(f"Campo desconocido en la regla '{line}': {field}")
+    values = [v.strip() for v in values.split(",") if v.strip()]
+    if not values:
+        raise ValueError(f"La regla '{line}' no tiene valores.")
+    return field, values
+
+def parse_rules(raw):
+    rules = []
+    for line in (raw or "").splitlines():
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        allow = "!->" not in line
+        sep   = "->" if allow else "!->"
+        if line.count(sep) != 1:
+            raise ValueError(f"Regla no válida: '{line}'. Usa '->' (solo con) o '!->' (nunca con).")
+        left, right = line.split(sep)
+        if_field, if_values     = _rule_side(left, line)
+        then_field, then_values = _rule_side(right, line)
+        if if_field == then_field:
+            raise ValueError(f"La regla '{line}' relaciona un campo consigo mismo.")
+        rules.append({"if_field": if_field, "if_values": if_values,
+                      "then_field": then_field, "then_values": then_values, "allow": allow})
+    return rules
+
+def rule_groups(rules, n_dims=len(UTM_FIELDS)):
+    """
+    Grupos de dimensiones relacionadas por reglas (componentes conexas), en orden de su primera
+    dimensión. Cada grupo se enumera aparte, solo con las dimensiones que nombran sus reglas, y se
+    poda; las dimensiones sin reglas quedan como grupos de una sola dimensión.
+    """
+    parent = list(range(n_dims))
+
+    def root(d):
+        while parent[d] != d:
+            d = parent[d]
+        return d
+
+    for r in rules:
+        a, b = root(UTM_FIELDS.index(r["if_field"])), root(UTM_FIELDS.index(r["then_field"]))
+        parent[max(a, b)] = min(a, b)
+    groups = {}
+    for d in range(n_dims):
+        groups.setdefault(root(d), []).append(d)
+    return sorted(groups.values())
+
+def prefix_runs(table):
+    """
+    Para cada columna j de una tabla ordenada: inicio y fin del tramo de filas que comparten
+    las columnas 0..j con cada fila. Con ellos se baja de un prefijo a sus filas sin buscar.
+    """
+    n, runs = len(table), []
+    change  = np.zeros(n, dtype=bool)
+    if n:
+        change[0] = True
+    for j in range(table.shape[1]):
+        change[1:] |= table[1:, j] != table[:-1, j]
+        starts = np.flatnonzero(change)
+        run_id = np.cumsum(change) - 1
+        runs.append((starts[run_id], np.append(starts[1:], n)[run_id]))
+    return runs
+
+
+class CombinationIndex:
+    """
+    Índice mixed-radix sobre las cinco listas de valores.
+    La fila N del producto se decodifica directamente a su (source, medium, campaign, content, term),
+    así que se puede paginar, saltar a cualquier página o muestrear sin construir el producto.
+
+    Internamente el producto es de "ejes": cada dimensión libre es un eje y cada grupo de
+    dimensiones relacionadas por reglas es un eje cuyas entradas son solo sus tuplas válidas.
+    Solo se enumeran las dimensiones que nombran las reglas: el recuento es el producto de los
+    tamaños de los ejes y cada fila se decodifica recorriendo los ejes, sin construir el producto.
+    """
+
+    def __init__(self, base_url, sources, mediums, campaigns, contents, terms, rules=()):
+        self.base_url  = base_url
+        self.dims      = [list(sources), list(mediums), list(campaigns), list(contents), list(terms)]
+        self.rules     = list(rules)
+        # Almacenamiento columnar: cada dimensión es un categórico (valores únicos + código por posición)
+        self._categories, self._cat_codes = zip(*[categorize(d) for d in self.dims])
+        self._pieces   = [encode_values(f, d, prefix=(f"{base_url}?" if i == 0 else "&"))
+                          for i, (f, d) in enumerate(zip(UTM_FIELDS, self.dims))]
+        self._postings = None
+        self._set_axes(self._build_axes())
+
+    def _build_axes(self):
+        """Lista de (dimensiones, tabla de códigos filas×dimensiones ordenada), una por grupo de reglas."""
+        axes = []
+        for ids in rule_groups(self.rules, len(self.dims)):
+            sizes = [len(self.dims[i]) for i in ids]
+            table = np.stack(decode_codes(np.arange(count_combinations([self.dims[i] for i in ids])), sizes), axis=1)
+            table = table.astype(compact_dtype(max(sizes, default=1)))
+            axes.append((ids, self._prune(ids, table)))
+        return axes
+
+    def _set_axes(self, axes):
+        self._axes = axes
+        self._runs = [prefix_runs(table) for _, table in axes]
+        self._axis_of = {d: (a, j) for a, (ids, _) in enumerate(axes) for j, d in enumerate(ids)}
+
+    def _prune(self, ids, table):
+        keep = np.ones(len(table), dtype=bool)
+        for r in self.rules:
+            fi, ft = UTM_FIELDS.index(r["if_field"]), UTM_FIELDS.index(r["then_field"])
+            if fi not in ids:
+                continue
+            hit_if   = np.isin(table[:, ids.index(fi)], self._positions(fi, r["if_values"]))
+            hit_then = np.isin(table[:, ids.index(ft)], self._positions(ft, r["then_values"]))
+            keep &= ~hit_if | (hit_then if r["allow"] else ~hit_then)
+        return table[keep]
+
+    def _positions(self, dim, values):
+        chosen = [self.postings[dim][v] for v in values if v in self.postings[dim]]
+        return np.unique(np.concatenate(chosen)) if chosen else np.empty(0, dtype=np.int32)
+
+    def __len__(self):
+        total = 1
+        for _, table in self._axes:
+            total *= len(table)
+        return total
+
+    @property
+    def nbytes(self):
+        """Memoria retenida por el índice: categorías, piezas codificadas y tablas de ejes, nunca las filas."""
+        return (sum(sys.getsizeof(v) for cats in self._categories for v in cats)
+                + sum(a.nbytes + sum(sys.getsizeof(v) for v in a) for a in self._pieces)
+                + sum(a.nbytes for a in self._cat_codes)
+                + sum(table.nbytes for _, table in self._axes)
+                + sum(s.nbytes + e.nbytes for runs in self._runs for s, e in runs))
+
+    def _codes(self, positions):
+        """
+        Nº de fila global -> códigos por dimensión, en el orden del producto original (la última
+        dimensión varía más rápido). Se recorren las dimensiones en orden; cada fila lleva, por eje,
+        el tramo [lo, hi) de tuplas compatibles con lo ya decidido. Elegir el valor de la dimensión d
+        es elegir un subtramo de su eje: las filas que empiezan por él son su tamaño por el de los
+        tramos de los demás ejes.
+        """
+        n     = np.array(positions, dtype=np.int64)
+        lo    = [np.zeros(len(n), dtype=np.int64) for _ in self._axes]
+        hi    = [np.full(len(n), len(table), dtype=np.int64) for _, table in self._axes]
+        rest  = np.full(len(n), len(self), dtype=np.int64)   # filas compatibles con lo ya decidido
+        codes = [None] * len(self.dims)
+        for d in range(len(self.dims)):
+            a, j   = self._axis_of[d]
+            size   = hi[a] - lo[a]
+            others = rest // size
+            row    = lo[a] + n // others
+            start, end = self._runs[a][j]
+            start, end = start[row], end[row]
+            n     -= (start - lo[a]) * others
+            rest   = others * (end - start)
+            lo[a], hi[a] = start, end
+            codes[d] = self._axes[a][1][row, j]
+        return codes
+
+    def decode(self, n):
+        if not 0 <= n < len(self):
+            raise IndexError(n)
+        return tuple(v[c[0]] for v, c in zip(self.dims, self._codes([n])))
+
+    def take(self, positions, with_url=True):
+        """
+        Construye las filas indicadas (vectorizado); el índice del DataFrame es el nº de fila global.
+        Las columnas UTM son categóricas; url_final solo se deriva de los códigos si se pide.
+        """
+        positions = np.asarray(positions, dtype=np.int64)
+        codes = self._codes(positions)
+        cols  = {f: pd.Categorical.from_codes(cc[c], categories=cats)
+                 for f, cc, cats, c in zip(UTM_FIELDS, self._cat_codes, self._categories, codes)}
+        if with_url:
+            cols["url_final"] = self.urls(codes)
+        return pd.DataFrame(cols, index=positions)
+
+    def urls(self, codes):
+        url = self._pieces[0][codes[0]]
+        for p, c in zip(self._pieces[1:], codes[1:]):
+            url = url + p[c]
+        return url
+
+    def page(self, page, page_size):
+        start = page * page_size
+        return self.take(np.arange(start, min(start + page_size, len(self))))
+
+    def sample(self, k, seed=None):
+        k   = min(k, len(self))
+        rng = np.random.default_rng(seed)
+        return self.take(np.sort(rng.choice(len(self), size=k, replace=False)))
+
+    def iter_chunks(self, chunk_size=CHUNK_SIZE):
+        """Recorre el rango completo en bloques de tamaño fijo (exportaciones)."""
+        total = len(self)
+        for start in range(0, total, chunk_size):
+            yield self.take(np.arange(start, min(start + chunk_size, total))).reset_index(drop=True)
+
+    @property
+    def postings(self):
+        """Índice invertido por dimensión: valor → posiciones (int32) en su lista. Se construye una vez."""
+        if self._postings is None:
+            postings = []
+            for d in self.dims:
+                pos = {}
+                for i, v in enumerate(d):
+                    pos.setdefault(v, []).append(i)
+                postings.append({v: np.array(p, dtype=np.int32) for v, p in pos.items()})
+            self._postings = postings
+        return self._postings
+
+    def filter(self, **selection):
+        """
+        Subíndice con las filas que cumplen todos los filtros, p.ej. filter(utm_source=["google"]).
+        La intersección se resuelve por eje sobre las posiciones del índice invertido:
+        el coste depende de los valores y tuplas de cada eje, no del número de filas.
+        """
+        axes = []
+        for ids, table in self._axes:
+            keep = np.ones(len(table), dtype=bool)
+            for j, d in enumerate(ids):
+                if selection.get(UTM_FIELDS[d]):
+                    keep &= np.isin(table[:, j], self._positions(d, selection[UTM_FIELDS[d]]))
+            axes.append((ids, table[keep]))
+        sub = copy.copy(self)
+        sub._set_axes(axes)
+        return sub
+
+# ── Exportación en streaming ──────────────────────────────────────
+# Cada bloque se escribe directamente a un fichero temporal en disco;
+# el fichero se borra solo al cerrarse tras la descarga.
+
+def _write_csv(chunks, f, columns):
+    wrote = False
+    for chunk in chunks:
+        chunk.to_csv(f, header=not wrote, index=False, encoding="utf-8")
+        wrote = True
+    if not wrote:   # sin filas: solo la cabecera
+        pd.DataFrame(columns=columns).to_csv(f, index=False, encoding="utf-8")
+
+def export_csv(chunks, columns=COLUMNS):
+    tmp = tempfile.TemporaryFile()
+    _write_csv(chunks, tmp, columns)
+    tmp.seek(0)
+    return tmp
+
+def export_csv_gz(chunks, columns=COLUMNS):
+    tmp = tempfile.TemporaryFile()
+    with gzip.GzipFile(fileobj=tmp, mode="wb") as gz:
+        _write_csv(chunks, gz, columns)
+    tmp.seek(0)
+    return tmp
+
+def _export_arrow(chunks, open_writer, columns=COLUMNS):
+    """
+    Escribe los bloques como tablas de Arrow; las columnas UTM categóricas pasan a dictionary.
+    Tabla y no RecordBatch: las columnas de texto Arrow ("string[pyarrow]") pueden venir troceadas.
+    """
+    import pyarrow as pa
+    tmp, writer = tempfile.TemporaryFile(), None
+    for chunk in chunks:
+        table  = pa.Table.from_pandas(chunk, preserve_index=False)
+        writer = writer or open_writer(tmp, table.schema)
+        writer.write_table(table)
+    if writer is None:   # sin filas: fichero válido solo con el esquema
+        writer = open_writer(tmp, pa.Schema.from_pandas(pd.DataFrame(columns=columns), preserve_index=False))
+    writer.close()
+    tmp.seek(0)
+    return tmp
+
+def export_parquet(chunks, columns=COLUMNS):
+    """Un row group por bloque, con codificación de diccionario en las columnas UTM."""
+    import pyarrow.parquet as pq
+    return _export_arrow(chunks, lambda f, schema: pq.ParquetWriter(f, schema, use_dictionary=UTM_FIELDS, compression="zstd"), columns)
+
+def export_feather(chunks):
+    """Feather v2 (fichero IPC de Arrow), escrito batch a batch."""
+    import pyarrow as pa
+    return _export_arrow(chunks, lambda f, schema: pa.ipc.new_file(f, schema, options=pa.ipc.IpcWriteOptions(compression="zstd")))
+
+def read_export(tmp):
+    """Contenido de un fichero de exportación ya escrito; st.download_button solo acepta bytes o buffers de lectura."""
+    with tmp:
+        tmp.seek(0)
+        return tmp.read()
+
+# Formatos columnares para cargar en el warehouse: nombre → (exportador, extensión, mime)
+COLUMNAR_FORMATS = {
+    "Parquet": (export_parquet, "parquet", "application/vnd.apache.parquet"),
+    "Feather": (export_feather, "feather", "application/vnd.apache.arrow.file"),
+    "CSV.gz":  (export_csv_gz,  "csv.gz",  "application/gzip"),
+}
+
+EXCEL_MAX_ROWS        = 1_048_576   # límite de filas de una hoja (cabecera incluida)
+EXCEL_SHEETS_PER_FILE = 4
+
+def excel_files_needed(n_rows, rows_per_sheet=EXCEL_MAX_ROWS - 1, sheets_per_file=EXCEL_SHEETS_PER_FILE):
+    sheets = max(1, -(-n_rows // rows_per_sheet))
+    return -(-sheets // sheets_per_file)
+
+def export_excel(chunks, sheet_name="URLs_UTM", file_stem="utm_urls_masivas",
+                 rows_per_sheet=EXCEL_MAX_ROWS - 1, sheets_per_file=EXCEL_SHEETS_PER_FILE, columns=COLUMNS):
+    """
+    Excel en streaming: al llenarse una hoja se abre otra y, al llenarse un fichero, otro.
+    Si hace falta más de un fichero se devuelve un zip; cada parte se añade al zip
+    en cuanto se cierra, así que en disco nunca hay más de una parte suelta.
+    """
+    w = {"wb": None, "ws": None, "tmp": None, "part": 0, "sheets": 0, "row": 0, "zip": None, "zip_tmp": None}
+
+    def close_part():
+        w["wb"].close()
+        w["tmp"].seek(0)
+        if w["zip"] is not None:
+            with w["zip"].open(f"{file_stem}_parte{w['part']}.xlsx", "w") as dst:
+                shutil.copyfileobj(w["tmp"], dst)
+            w["tmp"].close()
+
+    def new_sheet():
+        if w["wb"] is None or w["sheets"] == sheets_per_file:
+            if w["wb"] is not None:
+                if w["zip"] is None:
+                    w["zip_tmp"] = tempfile.TemporaryFile()
+                    w["zip"]     = zipfile.ZipFile(w["zip_tmp"], "w", zipfile.ZIP_DEFLATED)
+                close_part()
+            w["tmp"]  = tempfile.TemporaryFile()
+            w["part"] += 1
+            # constant_memory: xlsxwriter vuelca cada fila a disco en cuanto se termina
+            w["wb"]     = xlsxwriter.Workbook(w["tmp"], {"constant_memory": True, "strings_to_urls": False})
+            w["f_hdr"]  = w["wb"].add_format({"bold": True, "border": 1})
+            w["sheets"] = 0
+        w["sheets"] += 1
+        w["ws"]  = w["wb"].add_worksheet(sheet_name if w["sheets"] == 1 else f"{sheet_name}_{w['sheets']}")
+        w["ws"].write_row(0, 0, columns, w["f_hdr"])
+        w["row"] = 0
+
+    new_sheet()
+    for chunk in chunks:
+        for row in chunk.itertuples(index=False, name=None):
+            if w["row"] == rows_per_sheet:
+                new_sheet()
+            w["row"] += 1
+            w["ws"].write_row(w["row"], 0, row)
+    close_part()
+
+    if w["zip"] is None:
+        return w["tmp"]
+    w["zip"].close()
+    w["zip_tmp"].seek(0)
+    return w["zip_tmp"]
+
+# ── Exportación particionada ──────────────────────────────────────
+
+PARTITION_WORKERS = min(8, os.cpu_count() or 1)
+
+def partition_name(value):
+    return re.sub(r"[^\w\-]+", "_", value).strip("_") or "sin_valor"
+
+def partition_names(values):
+    """partition_name de cada valor, sin repetidos: "email marketing" y "email_marketing" no pueden compartir fichero."""
+    names, used = [], set()
+    for v in values:
+        base = name = partition_name(v)
+        n = 1
+        while name in used:
+            n += 1
+            name = f"{base}_{n}"
+        used.add(name)
+        names.append(name)
+    return names
+
+def export_partitioned(index, field, fmt="CSV", file_stem="utm_urls", max_workers=PARTITION_WORKERS):
+    """
+    Zip con un fichero por valor de `field`. Cada partición es un subíndice filtrado,
+    así que no se recorre el conjunto completo una vez por partición. Las particiones
+    se escriben en paralelo en un pool de hilos y se añaden al zip en orden.
+    """
+    d     = UTM_FIELDS.index(field)
+    parts = [(v, index.filter(**{field: [v]})) for v in index._categories[d]]
+    parts = [(v, sub) for v, sub in parts if len(sub)]
+    parts = list(zip(partition_names([v for v, _ in parts]), (sub for _, sub in parts)))
+
+    def write(part):
+        name, sub = part
+        if fmt == "Excel":
+            ext = "zip" if excel_files_needed(len(sub)) > 1 else "xlsx"
+            return f"{file_stem}_{name}.{ext}", export_excel(sub.iter_chunks())
+        return f"{file_stem}_{name}.csv", export_csv(sub.iter_chunks())
+
+    tmp = tempfile.TemporaryFile()
+    with zipfile.ZipFile(tmp, "w", zipfile.ZIP_DEFLATED) as archive, \
+         ThreadPoolExecutor(max_workers=max_workers) as pool:
+        for name, part_tmp in pool.map(write, parts):
+            with part_tmp, archive.open(name, "w") as dst:
+                shutil.copyfileobj(part_tmp, dst)
+    tmp.seek(0)
+    return tmp
+
+# ── Benchmark ─────────────────────────────────────────────────────
+# python bulk_engine.py  → compara la ruta fila a fila con la vectorizada
+
+def benchmark(n_values=(20, 10, 50, 10, 10), base_url="https://tusitio.com"):
+    dims = [[f"{f[4:]}_{i}" for i in range(n)] for f, n in zip(UTM_FIELDS, n_values)]
+    dims[3][0] = dims[4][0] = ""   # opcionales vacíos
+    total = count_combinations(dims)
+
+    t0 = time.perf_counter()
+    ref = pd.DataFrame(list(iter_rows(base_url, *dims)), columns=COLUMNS)["url_final"].tolist()
+    t_ref = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    vec = [u for chunk in CombinationIndex(base_url, *dims).iter_chunks() for u in chunk["url_final"].tolist()]
+    t_vec = time.perf_counter() - t0
+
+    assert "\n".join(ref).encode() == "\n".join(vec).encode(), "La salida vectorizada difiere de urlencode"
+    print(f"{total} URLs · fila a fila {t_ref:.2f}s · vectorizado {t_vec:.2f}s · x{t_ref / t_vec:.1f}")
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,114 @@
+# memo.py
+# Caché LRU acotada (nº de entradas y bytes) compartida entre sesiones de Streamlit
+
+import hashlib, json, sys, threading
+from collections import OrderedDict
+
+
+def fingerprint(*parts):
+    """Hash estable de las entradas (listas, strings, números) para usar como clave de caché."""
+    return hashlib.sha256(json.dumps(parts, ensure_ascii=False, default=str).encode()).hexdigest()
+
+
+def content_hash(data):
+    """Hash del contenido de un fichero (bytes o memoryview): mismo archivo → misma clave, aunque cambie el nombre."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def estimate_size(value):
+    """Tamaño aproximado en bytes de un valor cacheado."""
+    if hasattr(value, "nbytes") and not callable(value.nbytes):
+        return int(value.nbytes)
+    if hasattr(value, "memory_usage"):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, (bytes, bytearray, str)):
+        return len(value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(estimate_size(k) + estimate_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(estimate_size(v) for v in value)
+    return sys.getsizeof(value)
+
+
+class BoundedLRU:
+    """
+    LRU con límite de entradas y presupuesto de memoria.
+    Es segura entre hilos: cada sesión de Streamlit corre en su propio hilo.
+    Lleva contadores de aciertos, fallos y expulsiones para poder ajustar los límites.
+    """
+
+    def __init__(self, max_entries=64, max_bytes=256 * 2**20, sizeof=estimate_size):
+        self.max_entries = max_entries
+        self.max_bytes   = max_bytes
+        self.sizeof      = sizeof
+        self.nbytes      = 0
+        self.hits        = 0
+        self.misses      = 0
+        self.evictions   = 0
+        self.rejected    = 0               # valores más grandes que max_bytes, nunca cacheados
+        self._data       = OrderedDict()   # key -> (value, nbytes)
+        self._lock       = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._data.move_to_end(key)
+            return self._data[key][0]
+
+    def put(self, key, value):
+        size = self.sizeof(value)
+        with self._lock:
+            if key in self._data:
+                self.nbytes -= self._data.pop(key)[1]
+            if size > self.max_bytes:
+                self.rejected += 1
+                return value           # no cabe: se devuelve sin cachear
+            self._data[key] = (value, size)
+            self.nbytes += size
+            while len(self._data) > self.max_entries or self.nbytes > self.max_bytes:
+                _, (_, old_size) = self._data.popitem(last=False)
+                self.nbytes    -= old_size
+                self.evictions += 1
+        return value
+
+    def get_or_create(self, key, factory):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = self.put(key, factory())
+        return value
+
+    def stats(self):
+        """Contadores y ocupación actuales (para el panel de diagnóstico)."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entradas":     len(self._data),
+                "max_entradas": self.max_entries,
+                "MiB":          round(self.nbytes / 2**20, 3),
+                "max_MiB":      round(self.max_bytes / 2**20, 2),
+                "aciertos":     self.hits,
+                "fallos":       self.misses,
+                "tasa_acierto": round(self.hits / lookups, 3) if lookups else None,
+                "expulsiones":  self.evictions,
+                "rechazados":   self.rejected,
+            }
+
+
+_MISSING = object()
+
+
+def cached_export(cache, key, build):
+    """
+    Para st.download_button: devuelve un callable que serializa al pulsar descargar.
+    Los bytes se guardan en la caché con esa clave y los clics repetidos los reutilizan.
+    """
+    return lambda: cache.get_or_create(key, build)
@@ -1,12 +1,13 @@
 import sys, os
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 from style import apply_style
+from bulk_engine import (CombinationIndex, parse_rules, export_csv, export_excel, excel_files_needed,
+                         export_partitioned, read_export, COLUMNAR_FORMATS, UTM_FIELDS)
+from memo import BoundedLRU, fingerprint, cached_export
 
 import streamlit as st
 import re, itertools
-from io import BytesIO
 from urllib.parse import urlencode
-import pandas as pd
 
 st.set_page_config(page_title="UTM Genie — Generador", page_icon="🧙", layout="centered", initial_sidebar_state="expanded")
 apply_style()
@@ -68,6 +69,19 @@ st.markdown("---")
 
 # ── Helpers ───────────────────────────────────────────────────────────
 
+PAGE_SIZES  = [100, 500, 1000]
+SAMPLE_ROWS = 100
+
+@st.cache_resource
+def get_bulk_cache():
+    # Compartida por todas las sesiones: mismas entradas → mismo índice, sin regenerar
+    return BoundedLRU(max_entries=64, max_bytes=256 * 2**20)
+
+@st.cache_resource
+def get_export_cache():
+    # Descargas ya serializadas, por huella de contenido (índice + filtro + formato)
+    return BoundedLRU(max_entries=16, max_bytes=512 * 2**20)
+
 def is_valid_utm(v):
     return bool(re.match(r"^[a-zA-Z0-9_\-]+$", v))
 
@@ -206,13 +220,32 @@ else:
     contents  = parse_values(contents_raw) or [""]
     terms     = parse_values(terms_raw)    or [""]
 
+    with st.expander("Reglas entre dimensiones"):
+        st.caption("Una regla por línea. Las combinaciones que no las cumplen no se generan.")
+        rules_raw = st.text_area("Reglas", key="bulk_rules", label_visibility="collapsed",
+                                 placeholder="medium=email -> source=newsletter\nsource=newsletter !-> medium=cpc")
+        st.caption("`->` solo con esos valores · `!->` nunca con esos valores")
+    try:
+        rules = parse_rules(rules_raw)
+    except ValueError as e:
+        st.error(str(e))
+        rules = None
+
+    # La sesión solo guarda las entradas y su huella; el índice vive en la caché compartida
+    spec = {"base_url": base_url, "sources": sources, "mediums": mediums, "campaigns": campaigns,
+            "contents": contents, "terms": terms, "rules": rules or []}
+    spec_key = fingerprint(spec, campaign_mode)
+
     if sources or mediums or campaigns:
-        total = len(sources or [""]) * len(mediums or [""]) * len(campaigns or [""]) * len(contents) * len(terms)
         m1, m2, m3 = st.columns(3)
         m1.metric("Fuentes",  len(sources)   if sources   else 0)
         m2.metric("Medios",   len(mediums)   if mediums   else 0)
         m3.metric("Campañas", len(campaigns) if campaigns else 0)
-        if sources and mediums and campaigns:
+        if sources and mediums and campaigns and rules is None:
+            st.warning("Corrige las reglas para ver cuántas URLs se generarán.")
+        elif sources and mediums and campaigns:
+            # Con reglas, el total es el podado: producto de los ejes, sin enumerar las filas
+            total = len(get_bulk_cache().get_or_create(spec_key, lambda: CombinationIndex(**spec)))
             st.success(f"{total} URLs listas para generar.")
         else:
             st.warning("Completa utm_source, utm_medium y utm_campaign.")
@@ -222,41 +255,89 @@ else:
     if st.button("Generar todas las URLs", type="primary", use_container_width=True):
         if not sources or not mediums or not campaigns:
             st.error("Completa utm_source, utm_medium y utm_campaign.")
+        elif rules is None:
+            st.error("Corrige las reglas entre dimensiones antes de generar.")
         else:
-            rows = []
-            for src, med, cam, con, trm in itertools.product(sources, mediums, campaigns, contents, terms):
-                p = {"utm_source": src, "utm_medium": med, "utm_campaign": cam}
-                if con: p["utm_content"] = con
-                if trm: p["utm_term"]    = trm
-                rows.append({"utm_source": src, "utm_medium": med, "utm_campaign": cam,
-                              "utm_content": con or "", "utm_term": trm or "",
-                              "url_final": f"{base_url}?{urlencode(p)}"})
-            st.session_state["bulk_urls"] = pd.DataFrame(rows)
-            st.success(f"{len(rows)} URLs generadas.")
-
-    if "bulk_urls" in st.session_state:
-        df = st.session_state["bulk_urls"]
-        st.markdown(f"### {len(df)} URLs generadas")
-
-        filtered_df = df.copy()
+            st.session_state["bulk_spec"] = spec
+            st.session_state["bulk_key"]  = spec_key
+            st.session_state["bulk_page"] = 1
+            index = get_bulk_cache().get_or_create(spec_key, lambda: CombinationIndex(**spec))
+            st.success(f"{len(index)} URLs generadas.")
+
+    if "bulk_key" in st.session_state:
+        cache = get_bulk_cache()
+        key   = st.session_state["bulk_key"]
+        index = cache.get_or_create(key, lambda: CombinationIndex(**st.session_state["bulk_spec"]))
+        st.markdown(f"### {len(index)} URLs generadas")
+
         with st.expander("Filtrar resultados"):
-            f_source = st.multiselect("utm_source", options=df["utm_source"].unique())
-            f_medium = st.multiselect("utm_medium", options=df["utm_medium"].unique())
-            if f_source: filtered_df = filtered_df[filtered_df["utm_source"].isin(f_source)]
-            if f_medium: filtered_df = filtered_df[filtered_df["utm_medium"].isin(f_medium)]
+            selection = {}
+            for field_name, values in zip(UTM_FIELDS, index.dims):
+                options = [v for v in dict.fromkeys(values) if v]
+                if options:
+                    selection[field_name] = st.multiselect(field_name, options=options, key=f"bulk_f_{field_name}")
+        filter_key = fingerprint(key, selection)
+        filtered   = cache.get_or_create(filter_key, lambda: index.filter(**selection))
+
+        vista = st.radio("Vista", ["Páginas", "Muestra aleatoria"], horizontal=True, key="bulk_view")
+        if vista == "Páginas":
+            p1, p2 = st.columns([1, 1])
+            with p2:
+                page_size = st.selectbox("Filas por página", PAGE_SIZES, key="bulk_page_size")
+            n_pages = max(1, -(-len(filtered) // page_size))
+            if st.session_state.get("bulk_page", 1) > n_pages:
+                st.session_state["bulk_page"] = n_pages
+            with p1:
+                page = st.number_input(f"Página (de {n_pages})", min_value=1, max_value=n_pages, step=1, key="bulk_page")
+            view_df = filtered.page(int(page) - 1, page_size)
+        else:
+            if st.button("Nueva muestra"):
+                st.session_state["bulk_seed"] = st.session_state.get("bulk_seed", 0) + 1
+            view_df = filtered.sample(SAMPLE_ROWS, seed=st.session_state.get("bulk_seed", 0))
 
-        st.dataframe(filtered_df, use_container_width=True,
+        st.dataframe(view_df, use_container_width=True,
                      column_config={"url_final": st.column_config.LinkColumn("URL Final")})
+        st.caption(f"Mostrando {len(view_df)} de {len(filtered)} URLs. Las descargas incluyen todas.")
 
         c1, c2 = st.columns(2)
         with c1:
-            st.download_button("Descargar CSV", data=filtered_df.to_csv(index=False).encode(),
+            csv_data = cached_export(get_export_cache(), fingerprint(filter_key, "csv"), lambda: read_export(export_csv(filtered.iter_chunks())))
+            st.download_button("Descargar CSV", data=csv_data,
                                file_name="utm_urls_masivas.csv", mime="text/csv", use_container_width=True)
         with c2:
-            buf = BytesIO()
-            with pd.ExcelWriter(buf, engine="xlsxwriter") as w:
-                filtered_df.to_excel(w, index=False, sheet_name="URLs_UTM")
-            buf.seek(0)
-            st.download_button("Descargar Excel", data=buf, file_name="utm_urls_masivas.xlsx",
-                               mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                               use_container_width=True)
+            # Más de 1.048.576 filas no caben en una hoja: se reparten en hojas y, si hace falta, en un zip
+            if excel_files_needed(len(filtered)) > 1:
+                excel_name, excel_mime = "utm_urls_masivas.zip", "application/zip"
+            else:
+                excel_name, excel_mime = "utm_urls_masivas.xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+            excel_data = cached_export(get_export_cache(), fingerprint(filter_key, "xlsx"), lambda: read_export(export_excel(filtered.iter_chunks())))
+            st.download_button("Descargar Excel", data=excel_data,
+                               file_name=excel_name, mime=excel_mime, use_container_width=True)
+
+        # Formatos columnares para pipelines / warehouse
+        c3, c4 = st.columns(2)
+        with c3:
+            fmt_name = st.selectbox("Formato para warehouse", list(COLUMNAR_FORMATS), key="bulk_columnar_fmt",
+                                    label_visibility="collapsed")
+        with c4:
+            exporter, ext, mime = COLUMNAR_FORMATS[fmt_name]
+            columnar_data = cached_export(get_export_cache(), fingerprint(filter_key, fmt_name), lambda: read_export(exporter(filtered.iter_chunks())))
+            st.download_button(f"Descargar {fmt_name}", data=columnar_data,
+                               file_name=f"utm_urls_masivas.{ext}", mime=mime, use_container_width=True)
+
+        # Un fichero por valor de la dimensión elegida (p.ej. uno por utm_source para cada agencia)
+        with st.expander("Exportar por partición"):
+            split_fields = [f for f, values in zip(UTM_FIELDS, index.dims) if len(set(values)) > 1]
+            if not split_fields:
+                st.caption("Todas las dimensiones tienen un único valor: no hay nada que partir.")
+            else:
+                p1, p2 = st.columns(2)
+                with p1:
+                    split_field = st.selectbox("Un fichero por", split_fields, key="bulk_split_field")
+                with p2:
+                    split_fmt = st.selectbox("Formato", ["CSV", "Excel"], key="bulk_split_fmt")
+                zip_data = cached_export(get_export_cache(), fingerprint(filter_key, "particion", split_field, split_fmt),
+                                         lambda: read_export(export_partitioned(filtered, split_field, split_fmt)))
+                st.download_button("Descargar zip por partición", data=zip_data,
+                                   file_name=f"utm_urls_por_{split_field}.zip", mime="application/zip",
+                                   use_container_width=True)
@@ -1,14 +1,20 @@
-import sys, os
+import sys, os, multiprocessing
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 from style import apply_style
+from audit_engine import (REQUIRED, OPTIONAL, audit_url, audit_incremental, audit_changes, error_counts, EXPORT_COLUMNS,
+                          AuditTotals, read_url_chunks, audit_stream, unique_urls, with_messages,
+                          SAMPLE_SIZE, reservoir_sample, estimate_audit)
+from bulk_engine import export_csv, export_parquet, export_excel, excel_files_needed, read_export
+from audit_report import build_audit_excel
+from memo import BoundedLRU, fingerprint, content_hash, estimate_size, cached_export
 
 import streamlit as st
 import pandas as pd
-from urllib.parse import urlparse, parse_qs, urlencode, urlunparse, quote
-from collections import Counter
-from io import BytesIO
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime
-import xlsxwriter
+from functools import partial
 import re
 
 st.set_page_config(page_title="UTM Genie — Validador", page_icon="🧙", layout="centered")
@@ -71,139 +77,56 @@ st.markdown("""
 # Lógica de validación y corrección
 # ------------------------------------------------------------------
 
-REQUIRED = ["utm_source", "utm_medium", "utm_campaign"]
-OPTIONAL  = ["utm_content", "utm_term"]
-
-def validate_url(url: str) -> dict:
-    errors, warnings, params = [], [], {}
-    raw = str(url).strip()
-
-    if not raw or raw.lower() in ("nan", "none", ""):
-        return {"errors": ["URL vacía o nula"], "warnings": [], "params": {}, "valid": False, "score": 0}
-
-    parsed = urlparse(raw)
-    query  = parse_qs(parsed.query, keep_blank_values=True)
-
-    if not parsed.scheme.startswith("http"):
-        errors.append("Sin esquema http(s)")
-    if " " in raw:
-        errors.append("Contiene espacios")
-
-    for param in REQUIRED:
-        if param not in query:
-            errors.append(f"Falta {param}")
-        elif not query[param][0].strip():
-            errors.append(f"{param} vacío")
-        else:
-            params[param] = query[param][0]
-
-    for param in OPTIONAL:
-        if param in query:
-            val = query[param][0].strip()
-            if val:
-                params[param] = val
-            else:
-                warnings.append(f"{param} presente pero vacío")
-
-    raw_params = parsed.query.split("&")
-    keys = [p.split("=")[0] for p in raw_params if "=" in p]
-    dupes = [k for k, c in Counter(keys).items() if c > 1]
-    if dupes:
-        warnings.append(f"Parámetros duplicados: {', '.join(dupes)}")
-
-    if parsed.fragment and "utm_" in parsed.fragment:
-        warnings.append("UTMs en fragmento # — Analytics no los recoge")
-
-    score = max(0, 100 - len(errors) * 25 - len(warnings) * 10)
-
-    return {"errors": errors, "warnings": warnings, "params": params, "valid": len(errors) == 0, "score": score}
-
-
-def fix_url(url: str) -> dict:
-    """
-    Intenta corregir automáticamente la URL.
-    Devuelve: fixed_url, fixes_applied (lista), autocorregible (bool)
-    """
-    raw = str(url).strip()
-    fixes = []
-
-    if not raw or raw.lower() in ("nan", "none", ""):
-        return {"fixed_url": raw, "fixes": [], "autocorregible": False}
-
-    # 1. Limpiar espacios en la URL base
-    if " " in raw:
-        raw = raw.replace(" ", "%20")
-        fixes.append("Espacios reemplazados por %20")
-
-    parsed = urlparse(raw)
-
-    # 2. Mover UTMs del fragmento # al query
-    fragment_params = {}
-    if parsed.fragment and "utm_" in parsed.fragment:
-        frag_qs = parse_qs(parsed.fragment, keep_blank_values=True)
-        for k, v in frag_qs.items():
-            if k.startswith("utm_"):
-                fragment_params[k] = v[0]
-        if fragment_params:
-            fixes.append(f"UTMs movidos del fragmento al query: {', '.join(fragment_params.keys())}")
-
-    # 3. Parsear query actual y eliminar duplicados (conservar primero)
-    raw_pairs = parsed.query.split("&") if parsed.query else []
-    seen_keys = {}
-    deduped   = []
-    removed_dupes = []
-    for pair in raw_pairs:
-        if "=" not in pair:
-            continue
-        k, v = pair.split("=", 1)
-        if k not in seen_keys:
-            seen_keys[k] = v
-            deduped.append((k, v))
-        else:
-            removed_dupes.append(k)
-    if removed_dupes:
-        fixes.append(f"Duplicados eliminados: {', '.join(set(removed_dupes))}")
-
-    # 4. Normalizar valores UTM a minúsculas
-    normalized = []
-    norm_list  = []
-    for k, v in deduped:
-        if k.startswith("utm_") and v != v.lower():
-            norm_list.append(k)
-            normalized.append((k, v.lower()))
-        else:
-            normalized.append((k, v))
-    if norm_list:
-        fixes.append(f"Normalizados a minúsculas: {', '.join(norm_list)}")
-
-    # 5. Añadir UTMs del fragmento si no existen ya
-    final_params = dict(normalized)
-    for k, v in fragment_params.items():
-        if k not in final_params:
-            final_params[k] = v.lower()
-
-    # 6. Reconstruir query string conservando orden (requeridos primero)
-    order = REQUIRED + OPTIONAL
-    ordered = {k: v for k in order if k in final_params}
-    rest    = {k: v for k, v in final_params.items() if k not in ordered}
-    all_params = {**ordered, **rest}
-
-    new_query = urlencode(all_params)
-    fixed = urlunparse((parsed.scheme, parsed.netloc, parsed.path, parsed.params, new_query, ""))
-
-    # 7. ¿Es autocorregible? Solo si los 3 requeridos están presentes tras la corrección
-    result_check = validate_url(fixed)
-    autocorregible = result_check["valid"]
-
-    if not autocorregible:
-        missing = [p for p in REQUIRED if p not in all_params]
-        fixes.append(f"No autocorregible — faltan: {', '.join(missing)}")
-
-    return {
-        "fixed_url":      fixed,
-        "fixes":          fixes,
-        "autocorregible": autocorregible,
-    }
+@st.cache_resource
+def get_audit_pool():
+    # Un único pool por proceso de Streamlit, reutilizado entre ejecuciones y sesiones.
+    # Con un solo núcleo disponible no compensa: se audita en el propio hilo.
+    # forkserver y no fork: el servidor tiene hilos (tornado, sesiones) y un hijo creado con fork
+    # puede heredar un lock tomado y bloquearse. sys.path se pasa a los workers, así que importan audit_engine.
+    cores = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+    method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    return ProcessPoolExecutor(max_workers=cores, mp_context=multiprocessing.get_context(method)) if cores > 1 else None
+
+
+@st.cache_resource
+def get_url_cache():
+    # Diagnóstico de URL individual, compartido por todas las sesiones: las mismas URLs de
+    # tracking se comprueban una y otra vez. El resultado se comparte, así que no se modifica.
+    return BoundedLRU(max_entries=50_000, max_bytes=32 * 2**20)
+
+@st.cache_resource
+def get_audit_cache():
+    # Resultados de auditoría por hash del contenido del archivo, compartidos entre sesiones:
+    # el mismo export subido por varias personas se audita una sola vez. Cada entrada es
+    # (result_df, errores, URLs únicas, AuditSnapshot); todo depende solo del contenido
+    return BoundedLRU(max_entries=32, max_bytes=512 * 2**20,
+                      sizeof=lambda entry: estimate_size(entry[0]) + estimate_size(entry[2]) + estimate_size(entry[3]))
+
+def get_snapshot_cache():
+    # Versiones anteriores de los archivos de esta sesión, por nombre: (hash del contenido,
+    # AuditSnapshot, cambios). Es de la sesión: el nombre no identifica el archivo entre personas
+    if "file_versions" not in st.session_state:
+        st.session_state["file_versions"] = BoundedLRU(max_entries=8, max_bytes=256 * 2**20)
+    return st.session_state["file_versions"]
+
+@st.cache_resource
+def get_sheet_versions():
+    # Versiones anteriores por clave de hoja elegida por el usuario, compartidas entre sesiones:
+    # la subida diaria de la misma hoja se compara con la del día anterior aunque sea otra sesión
+    return BoundedLRU(max_entries=64, max_bytes=512 * 2**20)
+
+def file_key(uploaded_file):
+    """Hash del contenido del archivo subido; se calcula una vez por subida y sin copiar los bytes."""
+    file_id = getattr(uploaded_file, "file_id", None)
+    known   = st.session_state.get("file_key")
+    if file_id is None or known is None or known[0] != file_id:
+        known = st.session_state["file_key"] = (file_id, content_hash(uploaded_file.getbuffer()))
+    return known[1]
+
+@st.cache_resource
+def get_export_cache():
+    # Descargas ya serializadas, por huella del contenido del archivo auditado y formato
+    return BoundedLRU(max_entries=16, max_bytes=512 * 2**20)
 
 
 def score_color(score):
@@ -236,68 +159,321 @@ def param_status_html(result):
     return f'<div style="margin:14px 0">{"".join(rows)}</div>'
 
 
-# ------------------------------------------------------------------
-# Validación individual
-# ------------------------------------------------------------------
-
-st.markdown("## Validación individual")
-single_url = st.text_input("", placeholder="https://tusitio.com?utm_source=google&utm_medium=cpc&utm_campaign=...", label_visibility="collapsed")
-
-if single_url:
-    r   = validate_url(single_url)
-    fix = fix_url(single_url)
-    tc, bg, bd = score_color(r["score"])
-
-    # Score card
-    st.markdown(f"""
-    <div style="background:{bg};border:1.5px solid {bd};border-radius:8px;
-                padding:16px 20px;display:flex;align-items:center;gap:20px;margin:12px 0">
-      <div style="text-align:center;min-width:56px">
-        <div style="font-family:'Sora',sans-serif;font-size:1.8rem;font-weight:700;color:{tc};line-height:1">{r["score"]}</div>
-        <div style="font-size:0.6rem;letter-spacing:0.1em;text-transform:uppercase;color:{tc};opacity:0.7">score</div>
+def summary_html(total, ok, ko, avg_score, n_fixed):
+    """Scorecard resumen de una auditoría por archivo."""
+    sc, bg, bd = score_color(avg_score)
+    return f"""
+    <div style="background:{bg};border:1.5px solid {bd};border-radius:8px;padding:18px 24px;margin:16px 0">
+      <div style="font-family:'Sora',sans-serif;font-size:0.6rem;font-weight:500;
+                  letter-spacing:0.14em;text-transform:uppercase;color:{sc};margin-bottom:12px">
+        Resumen de auditoría · {datetime.now().strftime("%d/%m/%Y")}
       </div>
-      <div style="flex:1">
-        <div style="font-family:'Sora',sans-serif;font-size:0.82rem;font-weight:500;color:{tc}">
-          {"URL válida — todos los parámetros requeridos presentes" if r["valid"] else " · ".join(r["errors"])}
+      <div style="display:grid;grid-template-columns:repeat(5,1fr);gap:12px">
+        <div style="text-align:center">
+          <div style="font-size:1.5rem;font-weight:700;color:#1A1A1A">{total}</div>
+          <div style="font-size:0.6rem;letter-spacing:0.08em;text-transform:uppercase;color:#71717A">URLs</div>
+        </div>
+        <div style="text-align:center">
+          <div style="font-size:1.5rem;font-weight:700;color:#16a34a">{ok}</div>
+          <div style="font-size:0.6rem;letter-spacing:0.08em;text-transform:uppercase;color:#71717A">Correctas</div>
+        </div>
+        <div style="text-align:center">
+          <div style="font-size:1.5rem;font-weight:700;color:#E11D48">{ko}</div>
+          <div style="font-size:0.6rem;letter-spacing:0.08em;text-transform:uppercase;color:#71717A">Errores</div>
+        </div>
+        <div style="text-align:center">
+          <div style="font-size:1.5rem;font-weight:700;color:{sc}">{avg_score}</div>
+          <div style="font-size:0.6rem;letter-spacing:0.08em;text-transform:uppercase;color:#71717A">Score</div>
         </div>
-        {"" if not r["warnings"] else f'<div style="font-size:0.75rem;color:#92400E;margin-top:4px">Avisos: {" · ".join(r["warnings"])}</div>'}
+        <div style="text-align:center">
+          <div style="font-size:1.5rem;font-weight:700;color:#3D5A80">{n_fixed}</div>
+          <div style="font-size:0.6rem;letter-spacing:0.08em;text-transform:uppercase;color:#71717A">Autocorregidas</div>
+        </div>
+      </div>
+      <div style="background:#E4E4E7;border-radius:4px;height:5px;margin-top:14px">
+        <div style="background:{sc};width:{avg_score}%;height:5px;border-radius:4px"></div>
       </div>
     </div>
-    <div style="background:#E4E4E7;border-radius:4px;height:4px;margin:0 0 16px 0">
-      <div style="background:{tc};width:{r["score"]}%;height:4px;border-radius:4px"></div>
+    """
+
+
+def error_freq_html(all_errors):
+    """Listado de errores ordenados por frecuencia (all_errors es un Counter)."""
+    rows = "".join([
+        f'<div style="display:flex;justify-content:space-between;align-items:center;'
+        f'padding:9px 14px;background:{"#FFF8F8" if i%2==0 else "#FAFAFA"};border-radius:4px;margin:2px 0">'
+        f'<span style="font-size:0.78rem;color:#52525B">{err}</span>'
+        f'<span style="font-family:\'DM Mono\',monospace;font-size:0.78rem;font-weight:700;color:#E11D48">{cnt}</span>'
+        f'</div>'
+        for i, (err, cnt) in enumerate(all_errors.most_common())
+    ])
+    return f"""
+    <div style="margin:8px 0">
+      <div style="display:flex;justify-content:space-between;padding:0 14px 6px;
+                  font-size:0.62rem;letter-spacing:0.1em;text-transform:uppercase;color:#71717A">
+        <span>Error</span><span>Frecuencia</span>
+      </div>{rows}
+    </div>"""
+
+
+def estimate_html(est):
+    """Resumen de la estimación por muestreo: proporciones con su intervalo de confianza."""
+    pct    = lambda row: f'{row.tasa:.1%}<div style="font-size:0.62rem;color:#71717A">{row.ic_inf:.1%} – {row.ic_sup:.1%}</div>'
+    est_by = {row.diagnostico: row for row in est["estados"].itertuples()}
+    mean, lo, hi = est["score"]
+    sc, bg, bd   = score_color(mean)
+    cells = [("#16a34a", "Correctas", pct(est_by["OK"])),
+             ("#92400E", "Con avisos", pct(est_by["Aviso"])),
+             ("#E11D48", "Errores", pct(est_by["Error"])),
+             (sc, "Score medio", f'{mean:.0f}<div style="font-size:0.62rem;color:#71717A">{lo:.0f} – {hi:.0f}</div>')]
+    grid = "".join(f"""
+        <div style="text-align:center">
+          <div style="font-size:1.3rem;font-weight:700;color:{color}">{value}</div>
+          <div style="font-size:0.6rem;letter-spacing:0.08em;text-transform:uppercase;color:#71717A">{label}</div>
+        </div>""" for color, label, value in cells)
+    warn = ' <span style="font-size:0.62rem;color:#A1A1AA">(aviso)</span>'
+    rows = "".join(
+        f'<div style="display:flex;justify-content:space-between;align-items:center;'
+        f'padding:9px 14px;background:{"#FFF8F8" if i%2==0 else "#FAFAFA"};border-radius:4px;margin:2px 0">'
+        f'<span style="font-size:0.78rem;color:#52525B">{row.diagnostico}{"" if row.tipo == "error" else warn}</span>'
+        f'<span style="font-family:\'DM Mono\',monospace;font-size:0.74rem;color:#52525B">'
+        f'<b style="color:#E11D48">{row.tasa:.1%}</b> · {row.ic_inf:.1%} – {row.ic_sup:.1%} · ~{row.filas_estimadas:,} filas</span>'
+        f'</div>'
+        for i, row in enumerate(est["diagnosticos"].itertuples())
+    )
+    return f"""
+    <div style="background:{bg};border:1.5px solid {bd};border-radius:8px;padding:18px 24px;margin:16px 0">
+      <div style="font-family:'Sora',sans-serif;font-size:0.6rem;font-weight:500;
+                  letter-spacing:0.14em;text-transform:uppercase;color:{sc};margin-bottom:12px">
+        Estimación · muestra de {est["muestra"]:,} de {est["total"]:,} filas · IC {est["confianza"]:.0%}
+      </div>
+      <div style="display:grid;grid-template-columns:repeat(4,1fr);gap:12px">{grid}
+      </div>
     </div>
-    """, unsafe_allow_html=True)
-
-    # Desglose parámetros
-    st.markdown(param_status_html(r), unsafe_allow_html=True)
-
-    # URL corregida
-    st.markdown("### URL corregida")
-    if fix["fixes"]:
-        fixes_html = "".join([
-            f'<div style="font-size:0.74rem;color:#52525B;padding:2px 0">· {f}</div>'
-            for f in fix["fixes"]
-        ])
-        st.markdown(f"""
-        <div style="background:#F8FAFC;border:1.5px solid #E4E4E7;border-radius:6px;padding:14px 16px;margin-bottom:10px">
-          <div style="font-size:0.62rem;letter-spacing:0.1em;text-transform:uppercase;color:#71717A;margin-bottom:8px">Correcciones aplicadas</div>
-          {fixes_html}
-        </div>
-        """, unsafe_allow_html=True)
+    <div style="margin:8px 0">
+      <div style="display:flex;justify-content:space-between;padding:0 14px 6px;
+                  font-size:0.62rem;letter-spacing:0.1em;text-transform:uppercase;color:#71717A">
+        <span>Diagnóstico</span><span>Tasa · IC · filas estimadas</span>
+      </div>{rows}
+    </div>"""
+
+
+def changes_html(changes):
+    """Resumen de cambios respecto a la versión anterior del mismo archivo."""
+    cells = [(len(changes["nuevos_errores"]), "#E11D48", "Nuevos errores"),
+             (len(changes["corregidas"]),     "#16a34a", "Corregidas"),
+             (changes["sin_cambios"],         "#1A1A1A", "Sin cambios"),
+             (changes["reauditadas"],         "#3D5A80", "URLs reauditadas")]
+    grid = "".join(f"""
+        <div style="text-align:center">
+          <div style="font-size:1.3rem;font-weight:700;color:{color}">{value}</div>
+          <div style="font-size:0.6rem;letter-spacing:0.08em;text-transform:uppercase;color:#71717A">{label}</div>
+        </div>""" for value, color, label in cells)
+    removed = f" · {changes['eliminadas']} filas con URLs que ya no están" if changes["eliminadas"] else ""
+    return f"""
+    <div style="background:#FAFAFA;border:1.5px solid #E4E4E7;border-radius:8px;padding:16px 24px;margin:0 0 16px">
+      <div style="font-family:'Sora',sans-serif;font-size:0.6rem;font-weight:500;
+                  letter-spacing:0.14em;text-transform:uppercase;color:#71717A;margin-bottom:12px">
+        Cambios desde la subida anterior · {changes["nuevas"]} filas con URLs nuevas{removed}
+      </div>
+      <div style="display:grid;grid-template-columns:repeat(4,1fr);gap:12px">{grid}
+      </div>
+    </div>"""
+
+
+def render_table(data):
+    """Tabla HTML con estilo; recibe solo la página visible, nunca el resultado completo."""
+    counts   = "apariciones" in data.columns   # vista de URLs únicas
+    count_th = ('<th style="padding:8px 6px;font-size:0.6rem;letter-spacing:0.1em;text-transform:uppercase;'
+                'color:#71717A;font-weight:500;text-align:center">Apariciones</th>') if counts else ""
+    header = f"""
+    <div style="overflow-x:auto"><table style="width:100%;border-collapse:collapse;
+    font-family:'Sora',sans-serif;font-size:0.73rem">
+    <thead><tr style="border-bottom:2px solid #E4E4E7">
+      <th style="padding:8px 10px;font-size:0.6rem;letter-spacing:0.1em;text-transform:uppercase;color:#71717A;font-weight:500;text-align:left">Estado</th>
+      <th style="padding:8px 6px;font-size:0.6rem;letter-spacing:0.1em;text-transform:uppercase;color:#71717A;font-weight:500;text-align:center">Score</th>
+      <th style="padding:8px 10px;font-size:0.6rem;letter-spacing:0.1em;text-transform:uppercase;color:#71717A;font-weight:500;text-align:left">URL original</th>{count_th}
+      <th style="padding:8px 10px;font-size:0.6rem;letter-spacing:0.1em;text-transform:uppercase;color:#71717A;font-weight:500;text-align:left">Correcciones</th>
+      <th style="padding:8px 8px;font-size:0.6rem;letter-spacing:0.1em;text-transform:uppercase;color:#71717A;font-weight:500;text-align:center">Auto</th>
+    </tr></thead><tbody>"""
+
+    rows = []
+    for _, row in data.iterrows():
+        if row["estado"] == "OK":
+            badge  = '<span style="background:#DCFCE7;color:#16a34a;padding:2px 8px;border-radius:20px;font-size:0.65rem;font-weight:600">OK</span>'
+            row_bg = "#FAFFFE"
+            sc_col = "#16a34a"
+        elif row["estado"] == "Aviso":
+            badge  = '<span style="background:#FEF9C3;color:#92400E;padding:2px 8px;border-radius:20px;font-size:0.65rem;font-weight:600">Aviso</span>'
+            row_bg = "#FFFDF0"
+            sc_col = "#92400E"
+        else:
+            badge  = '<span style="background:#FFE4E6;color:#E11D48;padding:2px 8px;border-radius:20px;font-size:0.65rem;font-weight:600">Error</span>'
+            row_bg = "#FFF8F8"
+            sc_col = "#E11D48"
+
+        url_s = str(row["url_original"])[:52] + ("…" if len(str(row["url_original"])) > 52 else "")
+        corr  = str(row["correcciones"])[:55] + ("…" if len(str(row["correcciones"])) > 55 else "") if row["correcciones"] != "—" else '<span style="color:#A1A1AA">—</span>'
+        auto  = '<span style="color:#16a34a;font-weight:600">Sí</span>' if row["autocorregible"] else '<span style="color:#A1A1AA">No</span>'
+        count_td = (f'<td style="padding:9px 6px;text-align:center;font-family:\'DM Mono\',monospace;'
+                    f'color:#52525B">{row["apariciones"]}</td>') if counts else ""
+
+        rows.append(f"""<tr style="background:{row_bg};border-bottom:1px solid #F4F4F5">
+          <td style="padding:9px 10px">{badge}</td>
+          <td style="padding:9px 6px;text-align:center;font-weight:700;color:{sc_col};font-family:'DM Mono',monospace">{row["score"]}</td>
+          <td style="padding:9px 10px;font-family:'DM Mono',monospace;font-size:0.68rem;color:#3D5A80" title="{row['url_original']}">{url_s}</td>{count_td}
+          <td style="padding:9px 10px;font-size:0.71rem;color:#52525B">{corr}</td>
+          <td style="padding:9px 8px;text-align:center">{auto}</td>
+        </tr>""")
+
+    return f"{header}{''.join(rows)}</tbody></table></div>"
 
-    if fix["autocorregible"]:
-        st.code(fix["fixed_url"])
-        st.caption("URL corregida y lista para usar.")
+
+PAGE_SIZES = [100, 250, 500]
+SORTS      = {"Orden original": None, "Score ascendente": True, "Score descendente": False}
+
+
+@st.fragment
+def audit_table(df, key):
+    """
+    Tabla paginada en el servidor: el filtro y el orden se aplican sobre el DataFrame
+    y al navegador solo llega la página visible, sea cual sea el tamaño del archivo.
+    Es un fragmento: paginar, ordenar o buscar solo reejecuta esta tabla.
+    """
+    f1, f2 = st.columns([2, 1])
+    with f1:
+        query = st.text_input("Buscar en la URL", key=f"{key}_q", placeholder="Filtrar por texto de la URL…")
+    with f2:
+        sort = st.selectbox("Orden", list(SORTS), key=f"{key}_sort")
+    if query:
+        df = df[df["url_original"].str.contains(query, case=False, regex=False)]
+    if df.empty:
+        st.markdown('<p style="color:#71717A;font-size:0.85rem;padding:12px 0">Ninguna URL coincide con la búsqueda.</p>', unsafe_allow_html=True)
+        return
+
+    p1, p2 = st.columns([1, 1])
+    with p2:
+        page_size = st.selectbox("Filas por página", PAGE_SIZES, key=f"{key}_size")
+    n_pages = max(1, -(-len(df) // page_size))
+    if st.session_state.get(f"{key}_page", 1) > n_pages:
+        st.session_state[f"{key}_page"] = n_pages
+    with p1:
+        page = st.number_input(f"Página (de {n_pages})", min_value=1, max_value=n_pages, step=1, key=f"{key}_page")
+
+    # Solo se ordenan posiciones (argsort estable sobre el score), no el DataFrame entero
+    start = (int(page) - 1) * page_size
+    if SORTS[sort] is None:
+        view = df.iloc[start:start + page_size]
     else:
+        scores = df["score"].to_numpy()
+        order  = np.argsort(scores if SORTS[sort] else -scores, kind="stable")
+        view   = df.iloc[order[start:start + page_size]]
+
+    st.markdown(render_table(view), unsafe_allow_html=True)
+    st.caption(f"Mostrando {len(view)} de {len(df)} URLs.")
+
+
+@st.fragment
+def export_section(key, result_df, avg_score, ok, ko, avisos, n_fixed, total, all_errors, uniq_df):
+    """Descargas del reporte; al pulsarlas no se reejecuta la página (los bytes salen de la caché de exportación)."""
+    st.markdown("---")
+
+    excel_data = cached_export(get_export_cache(), fingerprint(key, "xlsx"), lambda: read_export(
+        build_audit_excel(result_df, avg_score, ok, ko, avisos, n_fixed, total, all_errors, uniq_df)))
+    csv_data   = cached_export(get_export_cache(), fingerprint(key, "csv"), lambda: with_messages(result_df).to_csv(index=False).encode())
+    fname      = f"auditoria_utm_{datetime.now().strftime('%Y%m%d_%H%M')}.xlsx"
+
+    c1, c2 = st.columns(2)
+    with c1:
+        st.download_button(
+            "Descargar auditoría Excel",
+            data=excel_data,
+            file_name=fname,
+            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            use_container_width=True,
+            type="primary",
+            on_click="ignore"
+        )
+    with c2:
+        st.download_button(
+            "Descargar CSV",
+            data=csv_data,
+            file_name=f"auditoria_utm_{datetime.now().strftime('%Y%m%d')}.csv",
+            mime="text/csv",
+            use_container_width=True,
+            on_click="ignore"
+        )
+
+    st.caption("El Excel incluye 5 hojas: Resumen ejecutivo · Auditoría completa · Solo errores · URLs corregidas listas para usar · URLs únicas con sus apariciones.")
+
+
+# ------------------------------------------------------------------
+# Validación individual
+# ------------------------------------------------------------------
+
+@st.fragment
+def single_url_section():
+    # Fragmento: escribir una URL solo reejecuta esta sección, no la auditoría del archivo
+    st.markdown("## Validación individual")
+    single_url = st.text_input("", placeholder="https://tusitio.com?utm_source=google&utm_medium=cpc&utm_campaign=...", label_visibility="collapsed")
+
+    if single_url:
+        r = fix = get_url_cache().get_or_create(single_url, lambda: audit_url(single_url))
+        tc, bg, bd = score_color(r["score"])
+
+        # Score card
         st.markdown(f"""
-        <div style="background:#FFF1F2;border:1.5px solid #FECDD3;border-radius:6px;padding:12px 16px;
-                    font-family:'Sora',sans-serif;font-size:0.8rem;color:#9F1239">
-          No autocorregible — faltan parámetros requeridos que deben añadirse manualmente.
+        <div style="background:{bg};border:1.5px solid {bd};border-radius:8px;
+                    padding:16px 20px;display:flex;align-items:center;gap:20px;margin:12px 0">
+          <div style="text-align:center;min-width:56px">
+            <div style="font-family:'Sora',sans-serif;font-size:1.8rem;font-weight:700;color:{tc};line-height:1">{r["score"]}</div>
+            <div style="font-size:0.6rem;letter-spacing:0.1em;text-transform:uppercase;color:{tc};opacity:0.7">score</div>
+          </div>
+          <div style="flex:1">
+            <div style="font-family:'Sora',sans-serif;font-size:0.82rem;font-weight:500;color:{tc}">
+              {"URL válida — todos los parámetros requeridos presentes" if r["valid"] else " · ".join(r["errors"])}
+            </div>
+            {"" if not r["warnings"] else f'<div style="font-size:0.75rem;color:#92400E;margin-top:4px">Avisos: {" · ".join(r["warnings"])}</div>'}
+          </div>
+        </div>
+        <div style="background:#E4E4E7;border-radius:4px;height:4px;margin:0 0 16px 0">
+          <div style="background:{tc};width:{r["score"]}%;height:4px;border-radius:4px"></div>
         </div>
         """, unsafe_allow_html=True)
-        if fix["fixed_url"] != single_url:
-            st.caption("Versión parcialmente corregida:")
+
+        # Desglose parámetros
+        st.markdown(param_status_html(r), unsafe_allow_html=True)
+
+        # URL corregida
+        st.markdown("### URL corregida")
+        if fix["fixes"]:
+            fixes_html = "".join([
+                f'<div style="font-size:0.74rem;color:#52525B;padding:2px 0">· {f}</div>'
+                for f in fix["fixes"]
+            ])
+            st.markdown(f"""
+            <div style="background:#F8FAFC;border:1.5px solid #E4E4E7;border-radius:6px;padding:14px 16px;margin-bottom:10px">
+              <div style="font-size:0.62rem;letter-spacing:0.1em;text-transform:uppercase;color:#71717A;margin-bottom:8px">Correcciones aplicadas</div>
+              {fixes_html}
+            </div>
+            """, unsafe_allow_html=True)
+
+        if fix["autocorregible"]:
             st.code(fix["fixed_url"])
+            st.caption("URL corregida y lista para usar.")
+        else:
+            st.markdown(f"""
+            <div style="background:#FFF1F2;border:1.5px solid #FECDD3;border-radius:6px;padding:12px 16px;
+                        font-family:'Sora',sans-serif;font-size:0.8rem;color:#9F1239">
+              No autocorregible — faltan parámetros requeridos que deben añadirse manualmente.
+            </div>
+            """, unsafe_allow_html=True)
+            if fix["fixed_url"] != single_url:
+                st.caption("Versión parcialmente corregida:")
+                st.code(fix["fixed_url"])
+
+
+single_url_section()
 
 st.markdown("---")
 
@@ -320,344 +496,213 @@ with col_dl:
 
 uploaded_file = st.file_uploader("", type=["csv", "xlsx"], label_visibility="collapsed")
 
-if uploaded_file:
+# Artefactos de la auditoría en streaming: formato → (exportador, extensión, mime)
+STREAM_ARTIFACTS = {
+    "CSV":     (partial(export_csv, columns=EXPORT_COLUMNS), "csv", "text/csv"),
+    "Parquet": (partial(export_parquet, columns=EXPORT_COLUMNS), "parquet", "application/vnd.apache.parquet"),
+    "Excel":   (partial(export_excel, sheet_name="Auditoría", file_stem="auditoria_utm", columns=EXPORT_COLUMNS),
+                "xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+}
+
+stream_mode = estimate_mode = False
+if uploaded_file and uploaded_file.name.endswith(".csv"):
+    estimate_mode = st.toggle("Estimación rápida antes de auditar", key="estimate_mode",
+                              help=f"Valida una muestra aleatoria de {SAMPLE_SIZE:,} URLs en una sola lectura del CSV y estima "
+                                   "la tasa de cada error con su intervalo de confianza. La auditoría completa se lanza después.")
+    c1, c2 = st.columns([2, 1])
+    with c1:
+        stream_mode = st.toggle("Modo streaming (CSV muy grandes)", key="stream_mode",
+                                help="Lee el CSV por bloques y escribe cada bloque auditado directamente a disco. "
+                                     "En memoria solo quedan los totales, así que no se muestran tablas.")
+    with c2:
+        stream_fmt = st.selectbox("Formato", list(STREAM_ARTIFACTS), key="stream_fmt",
+                                  label_visibility="collapsed", disabled=not stream_mode,
+                                  help="El archivo se escribe en este formato durante la auditoría: "
+                                       "cambiarlo vuelve a auditar el CSV completo.")
+    if stream_mode:
+        st.caption("Elige el formato antes de empezar: cambiarlo después reinicia la auditoría.")
+
+upload_id = getattr(uploaded_file, "file_id", None) or getattr(uploaded_file, "name", None)
+
+if estimate_mode and st.session_state.get("full_audit") != upload_id:
     try:
-        df = pd.read_csv(uploaded_file) if uploaded_file.name.endswith(".csv") else pd.read_excel(uploaded_file)
+        done = st.session_state.get("estimate")
+        if done is None or done["key"] != upload_id:
+            with st.spinner("Muestreando URLs…"):
+                sample, seen = reservoir_sample(read_url_chunks(uploaded_file))
+                est = estimate_audit(sample, seen)
+            uploaded_file.seek(0)   # la auditoría completa vuelve a leer el archivo desde el principio
+            done = st.session_state["estimate"] = {"key": upload_id, "est": est}
+
+        est = done["est"]
+        if est["muestra"] == 0:
+            st.warning("El archivo no contiene URLs.")
+        else:
+            st.markdown(estimate_html(est), unsafe_allow_html=True)
+            if st.button("Auditar archivo completo", type="primary", use_container_width=True):
+                st.session_state["full_audit"] = upload_id
+                st.rerun()
 
-        if "url" not in df.columns:
-            st.error("El archivo debe contener una columna llamada 'url'.")
+    except Exception as e:
+        st.error(f"Error al procesar el archivo: {e}")
+
+elif stream_mode:
+    try:
+        run_key = (upload_id, stream_fmt)
+        done    = st.session_state.get("stream_audit")
+        if done is None or done["key"] != run_key:
+            if done is not None:
+                done["tmp"].close()
+            totals   = AuditTotals()
+            progress = st.progress(0.0, text="Auditando URLs…")
+            size     = max(getattr(uploaded_file, "size", 0), 1)
+
+            def on_chunk(t):
+                # Posición aproximada en el archivo: pandas lee por delante en su búfer
+                progress.progress(min(uploaded_file.tell() / size, 1.0), text=f"Auditando URLs… {t.total:,} filas")
+
+            exporter = STREAM_ARTIFACTS[stream_fmt][0]
+            try:
+                tmp = exporter(audit_stream(read_url_chunks(uploaded_file), totals, get_audit_pool(), on_chunk))
+            except BrokenProcessPool:
+                # Un worker murió: se descarta el pool y se repite la pasada desde el principio en este hilo
+                get_audit_pool.clear()
+                uploaded_file.seek(0)
+                totals = AuditTotals()
+                tmp    = exporter(audit_stream(read_url_chunks(uploaded_file), totals, None, on_chunk))
+            progress.empty()
+            done = st.session_state["stream_audit"] = {"key": run_key, "totals": totals, "tmp": tmp}
+
+        totals = done["totals"]
+        if totals.total == 0:
+            st.warning("El archivo no contiene URLs.")
         else:
-            rows      = []
-            all_errors = []
+            st.markdown(summary_html(totals.total, totals.estados["OK"], totals.estados["Error"],
+                                     totals.avg_score, totals.n_fixed), unsafe_allow_html=True)
+            if totals.errors:
+                st.markdown(error_freq_html(totals.errors), unsafe_allow_html=True)
+
+            _, ext, mime = STREAM_ARTIFACTS[stream_fmt]
+            if stream_fmt == "Excel" and excel_files_needed(totals.total) > 1:
+                ext, mime = "zip", "application/zip"
+
+            def read_artifact(tmp=done["tmp"]):
+                tmp.seek(0)
+                return tmp.read()
+
+            st.download_button(
+                f"Descargar auditoría {stream_fmt}",
+                data=read_artifact,
+                file_name=f"auditoria_utm_{datetime.now().strftime('%Y%m%d')}.{ext}",
+                mime=mime,
+                use_container_width=True,
+                type="primary",
+                on_click="ignore"
+            )
 
-            for _, row in df.iterrows():
-                r   = validate_url(str(row["url"]))
-                fix = fix_url(str(row["url"]))
+    except Exception as e:
+        st.error(f"Error al procesar el archivo: {e}")
 
-                if r["valid"]:
-                    estado = "OK"
-                elif r["warnings"] and not r["errors"]:
-                    estado = "Aviso"
-                else:
-                    estado = "Error"
-
-                rows.append({
-                    "url_original":   str(row["url"]),
-                    "url_corregida":  fix["fixed_url"],
-                    "autocorregible": "Sí" if fix["autocorregible"] else "No",
-                    "estado":         estado,
-                    "score":          r["score"],
-                    "correcciones":   "; ".join(fix["fixes"]) if fix["fixes"] else "—",
-                    "errores":        "; ".join(r["errors"])   if r["errors"]   else "—",
-                    "avisos":         "; ".join(r["warnings"]) if r["warnings"] else "—",
-                    "utm_source":     r["params"].get("utm_source",   ""),
-                    "utm_medium":     r["params"].get("utm_medium",   ""),
-                    "utm_campaign":   r["params"].get("utm_campaign", ""),
-                    "utm_content":    r["params"].get("utm_content",  ""),
-                    "utm_term":       r["params"].get("utm_term",     ""),
-                })
-                all_errors.extend(r["errors"])
-
-            result_df  = pd.DataFrame(rows)
+elif uploaded_file:
+    try:
+        cache = get_audit_cache()
+        key   = file_key(uploaded_file)
+        result_df, all_errors, uniq_df, snapshot = cache.get(key, (None, None, None, None))
+        sheet_key = st.text_input("Clave de la hoja (opcional)", key="sheet_key", placeholder="p. ej. campañas-newsletter",
+                                  help="Con la misma clave, cada subida se compara con la anterior de esa hoja, "
+                                       "aunque sea otro día o desde otra sesión. Cualquiera que use la clave ve y "
+                                       "sustituye esa versión.").strip()
+        if sheet_key:
+            versions, version_id = get_sheet_versions(), fingerprint("hoja", sheet_key)
+        else:
+            versions, version_id = get_snapshot_cache(), uploaded_file.name
+            st.caption("Sin clave de hoja, la comparación con la versión anterior solo funciona dentro de esta sesión.")
+        prev_key, previous, changes = versions.get(version_id, (None, None, None))
+        if prev_key != key:
+            changes = None   # se recalculan contra la versión anterior guardada
+
+        if result_df is None:
+            df = pd.read_csv(uploaded_file) if uploaded_file.name.endswith(".csv") else pd.read_excel(uploaded_file)
+            if "url" in df.columns:
+                progress = st.progress(0.0, text="Auditando URLs…")
+                try:
+                    result_df, snapshot, diff = audit_incremental(
+                        df["url"], previous, get_audit_pool(),
+                        on_progress=lambda d, t: progress.progress(d / t, text=f"Auditando URLs… {d}/{t} bloques"))
+                except BrokenProcessPool:
+                    # Un worker murió: se descarta el pool (se recrea en la siguiente ejecución) y se audita aquí
+                    get_audit_pool.clear()
+                    result_df, snapshot, diff = audit_incremental(df["url"], previous)
+                progress.empty()
+                if prev_key != key:
+                    changes = diff
+                all_errors = error_counts(result_df)
+                uniq_df    = unique_urls(result_df)
+                cache.put(key, (result_df, all_errors, uniq_df, snapshot))
+        elif previous is not None and prev_key != key:
+            # Ya auditado (quizá en otra sesión): solo falta compararlo con la versión anterior guardada
+            changes = {**audit_changes(previous, snapshot), "reauditadas": 0}
+
+        if result_df is not None and prev_key != key:
+            versions.put(version_id, (key, snapshot, changes))
+
+        if result_df is None:
+            st.error("El archivo debe contener una columna llamada 'url'.")
+        else:
             total      = len(result_df)
             ok         = (result_df["estado"] == "OK").sum()
             avisos     = (result_df["estado"] == "Aviso").sum()
             ko         = (result_df["estado"] == "Error").sum()
             avg_score  = int(result_df["score"].mean())
-            n_fixed    = (result_df["autocorregible"] == "Sí").sum()
+            n_fixed    = result_df["autocorregible"].sum()
 
-            # Scorecard resumen
-            sc, bg, bd = score_color(avg_score)
-            st.markdown(f"""
-            <div style="background:{bg};border:1.5px solid {bd};border-radius:8px;padding:18px 24px;margin:16px 0">
-              <div style="font-family:'Sora',sans-serif;font-size:0.6rem;font-weight:500;
-                          letter-spacing:0.14em;text-transform:uppercase;color:{sc};margin-bottom:12px">
-                Resumen de auditoría · {datetime.now().strftime("%d/%m/%Y")}
-              </div>
-              <div style="display:grid;grid-template-columns:repeat(5,1fr);gap:12px">
-                <div style="text-align:center">
-                  <div style="font-size:1.5rem;font-weight:700;color:#1A1A1A">{total}</div>
-                  <div style="font-size:0.6rem;letter-spacing:0.08em;text-transform:uppercase;color:#71717A">URLs</div>
-                </div>
-                <div style="text-align:center">
-                  <div style="font-size:1.5rem;font-weight:700;color:#16a34a">{ok}</div>
-                  <div style="font-size:0.6rem;letter-spacing:0.08em;text-transform:uppercase;color:#71717A">Correctas</div>
-                </div>
-                <div style="text-align:center">
-                  <div style="font-size:1.5rem;font-weight:700;color:#E11D48">{ko}</div>
-                  <div style="font-size:0.6rem;letter-spacing:0.08em;text-transform:uppercase;color:#71717A">Errores</div>
-                </div>
-                <div style="text-align:center">
-                  <div style="font-size:1.5rem;font-weight:700;color:{sc}">{avg_score}</div>
-                  <div style="font-size:0.6rem;letter-spacing:0.08em;text-transform:uppercase;color:#71717A">Score</div>
-                </div>
-                <div style="text-align:center">
-                  <div style="font-size:1.5rem;font-weight:700;color:#3D5A80">{n_fixed}</div>
-                  <div style="font-size:0.6rem;letter-spacing:0.08em;text-transform:uppercase;color:#71717A">Autocorregidas</div>
-                </div>
-              </div>
-              <div style="background:#E4E4E7;border-radius:4px;height:5px;margin-top:14px">
-                <div style="background:{sc};width:{avg_score}%;height:5px;border-radius:4px"></div>
-              </div>
-            </div>
-            """, unsafe_allow_html=True)
+            st.markdown(summary_html(total, ok, ko, avg_score, n_fixed), unsafe_allow_html=True)
+
+            if changes is not None:
+                st.markdown(changes_html(changes), unsafe_allow_html=True)
+                if len(changes["nuevos_errores"]) or len(changes["corregidas"]):
+                    with st.expander("Ver filas que cambiaron de estado"):
+                        for label, rows, tbl in (("Nuevos errores", changes["nuevos_errores"], "tbl_broken"),
+                                                 ("Corregidas", changes["corregidas"], "tbl_repaired")):
+                            if len(rows):
+                                st.markdown(f"**{label}**")
+                                audit_table(result_df.iloc[rows], tbl)
 
-            # Tabla visual
-            def render_table(data):
-                header = """
-                <div style="overflow-x:auto"><table style="width:100%;border-collapse:collapse;
-                font-family:'Sora',sans-serif;font-size:0.73rem">
-                <thead><tr style="border-bottom:2px solid #E4E4E7">
-                  <th style="padding:8px 10px;font-size:0.6rem;letter-spacing:0.1em;text-transform:uppercase;color:#71717A;font-weight:500;text-align:left">Estado</th>
-                  <th style="padding:8px 6px;font-size:0.6rem;letter-spacing:0.1em;text-transform:uppercase;color:#71717A;font-weight:500;text-align:center">Score</th>
-                  <th style="padding:8px 10px;font-size:0.6rem;letter-spacing:0.1em;text-transform:uppercase;color:#71717A;font-weight:500;text-align:left">URL original</th>
-                  <th style="padding:8px 10px;font-size:0.6rem;letter-spacing:0.1em;text-transform:uppercase;color:#71717A;font-weight:500;text-align:left">Correcciones</th>
-                  <th style="padding:8px 8px;font-size:0.6rem;letter-spacing:0.1em;text-transform:uppercase;color:#71717A;font-weight:500;text-align:center">Auto</th>
-                </tr></thead><tbody>"""
-
-                body = ""
-                for _, row in data.iterrows():
-                    if row["estado"] == "OK":
-                        badge  = '<span style="background:#DCFCE7;color:#16a34a;padding:2px 8px;border-radius:20px;font-size:0.65rem;font-weight:600">OK</span>'
-                        row_bg = "#FAFFFE"
-                        sc_col = "#16a34a"
-                    elif row["estado"] == "Aviso":
-                        badge  = '<span style="background:#FEF9C3;color:#92400E;padding:2px 8px;border-radius:20px;font-size:0.65rem;font-weight:600">Aviso</span>'
-                        row_bg = "#FFFDF0"
-                        sc_col = "#92400E"
-                    else:
-                        badge  = '<span style="background:#FFE4E6;color:#E11D48;padding:2px 8px;border-radius:20px;font-size:0.65rem;font-weight:600">Error</span>'
-                        row_bg = "#FFF8F8"
-                        sc_col = "#E11D48"
-
-                    url_s = str(row["url_original"])[:52] + ("…" if len(str(row["url_original"])) > 52 else "")
-                    corr  = str(row["correcciones"])[:55] + ("…" if len(str(row["correcciones"])) > 55 else "") if row["correcciones"] != "—" else '<span style="color:#A1A1AA">—</span>'
-                    auto  = '<span style="color:#16a34a;font-weight:600">Sí</span>' if row["autocorregible"] == "Sí" else '<span style="color:#A1A1AA">No</span>'
-
-                    body += f"""<tr style="background:{row_bg};border-bottom:1px solid #F4F4F5">
-                      <td style="padding:9px 10px">{badge}</td>
-                      <td style="padding:9px 6px;text-align:center;font-weight:700;color:{sc_col};font-family:'DM Mono',monospace">{row["score"]}</td>
-                      <td style="padding:9px 10px;font-family:'DM Mono',monospace;font-size:0.68rem;color:#3D5A80" title="{row['url_original']}">{url_s}</td>
-                      <td style="padding:9px 10px;font-size:0.71rem;color:#52525B">{corr}</td>
-                      <td style="padding:9px 8px;text-align:center">{auto}</td>
-                    </tr>"""
-
-                return f"{header}{body}</tbody></table></div>"
-
-            tab1, tab2, tab3, tab4 = st.tabs(["Todas", "Solo errores", "Autocorregidas", "Errores frecuentes"])
+            tab1, tab2, tab3, tab4, tab5 = st.tabs(["Todas", "Solo errores", "Autocorregidas", "Errores frecuentes", "URLs únicas"])
 
             with tab1:
-                st.markdown(render_table(result_df), unsafe_allow_html=True)
+                audit_table(result_df, "tbl_all")
             with tab2:
                 err_df = result_df[result_df["estado"] == "Error"]
                 if err_df.empty:
                     st.markdown('<p style="color:#16a34a;font-size:0.85rem;padding:12px 0">Sin errores.</p>', unsafe_allow_html=True)
                 else:
-                    st.markdown(render_table(err_df), unsafe_allow_html=True)
+                    audit_table(err_df, "tbl_err")
             with tab3:
-                fixed_df = result_df[result_df["autocorregible"] == "Sí"]
+                fixed_df = result_df[result_df["autocorregible"]]
                 if fixed_df.empty:
                     st.markdown('<p style="color:#71717A;font-size:0.85rem;padding:12px 0">Ninguna URL fue autocorregida.</p>', unsafe_allow_html=True)
                 else:
-                    st.markdown(render_table(fixed_df), unsafe_allow_html=True)
+                    audit_table(fixed_df, "tbl_fixed")
             with tab4:
                 if all_errors:
-                    freq     = Counter(all_errors).most_common()
-                    freq_html = "".join([
-                        f'<div style="display:flex;justify-content:space-between;align-items:center;'
-                        f'padding:9px 14px;background:{"#FFF8F8" if i%2==0 else "#FAFAFA"};border-radius:4px;margin:2px 0">'
-                        f'<span style="font-size:0.78rem;color:#52525B">{err}</span>'
-                        f'<span style="font-family:\'DM Mono\',monospace;font-size:0.78rem;font-weight:700;color:#E11D48">{cnt}</span>'
-                        f'</div>'
-                        for i, (err, cnt) in enumerate(freq)
-                    ])
-                    st.markdown(f"""
-                    <div style="margin:8px 0">
-                      <div style="display:flex;justify-content:space-between;padding:0 14px 6px;
-                                  font-size:0.62rem;letter-spacing:0.1em;text-transform:uppercase;color:#71717A">
-                        <span>Error</span><span>Frecuencia</span>
-                      </div>{freq_html}
-                    </div>""", unsafe_allow_html=True)
+                    st.markdown(error_freq_html(all_errors), unsafe_allow_html=True)
                 else:
                     st.markdown('<p style="color:#16a34a;font-size:0.85rem;padding:12px 0">Sin errores.</p>', unsafe_allow_html=True)
+            with tab5:
+                st.caption(f"{len(uniq_df)} URLs únicas en {total} filas. Cada URL distinta se audita una sola vez.")
+                audit_table(uniq_df, "tbl_unique")
 
-            # ── Excel de auditoría ─────────────────────────────────
-            st.markdown("---")
-
-            def build_audit_excel(result_df, avg_score, ok, ko, avisos, n_fixed, total, all_errors):
-                buf = BytesIO()
-                wb  = xlsxwriter.Workbook(buf)
-
-                # Formatos base
-                def fmt(wb, **kw):
-                    base = {"font_name": "Arial", "font_size": 8, "valign": "vcenter"}
-                    base.update(kw)
-                    return wb.add_format(base)
-
-                f_title  = fmt(wb, font_size=14, bold=True, font_color="#1A1A1A")
-                f_meta   = fmt(wb, font_size=9, font_color="#71717A")
-                f_hdr    = fmt(wb, bold=True, font_color="#FFFFFF", bg_color="#3D5A80",
-                               border=1, border_color="#2e4460", align="center", text_wrap=True, font_size=8)
-                f_ok     = fmt(wb, bold=True, font_color="#166534", bg_color="#DCFCE7", align="center", border=1, border_color="#BBF7D0")
-                f_warn   = fmt(wb, bold=True, font_color="#92400E", bg_color="#FEF9C3", align="center", border=1, border_color="#FDE68A")
-                f_err    = fmt(wb, bold=True, font_color="#9F1239", bg_color="#FFE4E6", align="center", border=1, border_color="#FECDD3")
-                f_sc_ok  = fmt(wb, bold=True, font_color="#16a34a", align="center", border=1, border_color="#E4E4E7")
-                f_sc_w   = fmt(wb, bold=True, font_color="#92400E", align="center", border=1, border_color="#E4E4E7")
-                f_sc_e   = fmt(wb, bold=True, font_color="#E11D48", align="center", border=1, border_color="#E4E4E7")
-                f_url    = fmt(wb, font_name="Courier New", font_color="#3D5A80", border=1, border_color="#E4E4E7")
-                f_url_fix= fmt(wb, font_name="Courier New", font_color="#16a34a", border=1, border_color="#BBF7D0", bg_color="#F0FDF4")
-                f_cell   = fmt(wb, border=1, border_color="#E4E4E7")
-                f_mono   = fmt(wb, font_name="Courier New", font_color="#3D5A80", border=1, border_color="#E4E4E7")
-                f_fix_lbl= fmt(wb, font_color="#166534", bg_color="#F0FDF4", border=1, border_color="#BBF7D0")
-
-                # ── Hoja 1: Resumen ejecutivo ──────────────────────
-                ws1 = wb.add_worksheet("Resumen")
-                ws1.set_tab_color("#3D5A80")
-                ws1.set_column("A:A", 30)
-                ws1.set_column("B:B", 18)
-
-                ws1.write("A1", "Reporte de Auditoría UTM", f_title)
-                ws1.write("A2", f"Generado: {datetime.now().strftime('%d/%m/%Y %H:%M')}", f_meta)
-
-                ws1.write("A4", "RESUMEN GLOBAL", fmt(wb, font_size=8, bold=True, font_color="#3D5A80"))
-                summary = [
-                    ("URLs analizadas",     total),
-                    ("URLs correctas",      ok),
-                    ("URLs con avisos",     avisos),
-                    ("URLs con errores",    ko),
-                    ("URLs autocorregidas", n_fixed),
-                    ("Score medio",         f"{avg_score}/100"),
-                    ("Tasa de error",       f"{round(ko/total*100,1)}%" if total else "0%"),
-                    ("Tasa autocorrección", f"{round(n_fixed/ko*100,1)}%" if ko else "N/A"),
-                ]
-                for i, (label, val) in enumerate(summary):
-                    bg = "#FAFAFA" if i % 2 == 0 else "#FFFFFF"
-                    ws1.write(5+i, 0, label, fmt(wb, border=1, border_color="#E4E4E7", bg_color=bg))
-                    ws1.write(5+i, 1, val,   fmt(wb, bold=True, align="center", border=1, border_color="#E4E4E7", bg_color=bg))
-
-                if all_errors:
-                    ws1.write("A15", "ERRORES MÁS FRECUENTES", fmt(wb, font_size=8, bold=True, font_color="#3D5A80"))
-                    ws1.write("A16", "Error",      f_hdr)
-                    ws1.write("B16", "Frecuencia", f_hdr)
-                    for i, (err, cnt) in enumerate(Counter(all_errors).most_common(10)):
-                        bg = "#FFF8F8" if i % 2 == 0 else "#FFFFFF"
-                        ws1.write(16+i, 0, err, fmt(wb, border=1, border_color="#E4E4E7", bg_color=bg))
-                        ws1.write(16+i, 1, cnt, fmt(wb, bold=True, font_color="#E11D48", align="center", border=1, border_color="#E4E4E7", bg_color=bg))
-
-                # ── Hoja 2: Auditoría completa ─────────────────────
-                ws2 = wb.add_worksheet("Auditoría completa")
-                ws2.set_tab_color("#3D5A80")
-                ws2.freeze_panes(1, 0)
-                ws2.set_row(0, 26)
-
-                cols2   = ["Estado","Score","URL original","URL corregida","Autocorregible",
-                           "Correcciones aplicadas","Errores","Avisos",
-                           "utm_source","utm_medium","utm_campaign","utm_content","utm_term"]
-                widths2 = [10,8,55,55,14,45,40,35,16,14,24,16,16]
-                for c,(col,w) in enumerate(zip(cols2,widths2)):
-                    ws2.write(0,c,col,f_hdr)
-                    ws2.set_column(c,c,w)
-
-                for i, row in result_df.iterrows():
-                    r_num = i + 1
-                    ws2.set_row(r_num, 15)
-                    sfmt  = f_ok if row["estado"]=="OK" else (f_warn if row["estado"]=="Aviso" else f_err)
-                    scfmt = f_sc_ok if row["score"]>=90 else (f_sc_w if row["score"]>=60 else f_sc_e)
-                    ufmt  = f_url_fix if row["autocorregible"]=="Sí" else f_url
-
-                    ws2.write(r_num, 0,  row["estado"],        sfmt)
-                    ws2.write(r_num, 1,  row["score"],         scfmt)
-                    ws2.write(r_num, 2,  row["url_original"],  f_url)
-                    ws2.write(r_num, 3,  row["url_corregida"], ufmt)
-                    ws2.write(r_num, 4,  row["autocorregible"],f_fix_lbl if row["autocorregible"]=="Sí" else f_cell)
-                    ws2.write(r_num, 5,  row["correcciones"],  f_cell)
-                    ws2.write(r_num, 6,  row["errores"],       f_cell)
-                    ws2.write(r_num, 7,  row["avisos"],        f_cell)
-                    ws2.write(r_num, 8,  row["utm_source"],    f_mono)
-                    ws2.write(r_num, 9,  row["utm_medium"],    f_mono)
-                    ws2.write(r_num, 10, row["utm_campaign"],  f_mono)
-                    ws2.write(r_num, 11, row["utm_content"],   f_mono)
-                    ws2.write(r_num, 12, row["utm_term"],      f_mono)
-
-                # ── Hoja 3: Solo errores ───────────────────────────
-                ws3 = wb.add_worksheet("Errores")
-                ws3.set_tab_color("#E11D48")
-                ws3.freeze_panes(1, 0)
-                ws3.set_row(0, 26)
-                for c,(col,w) in enumerate(zip(cols2,widths2)):
-                    ws3.write(0,c,col,f_hdr)
-                    ws3.set_column(c,c,w)
-
-                err_rows = result_df[result_df["estado"]=="Error"]
-                for i,(_, row) in enumerate(err_rows.iterrows()):
-                    ws3.set_row(i+1,15)
-                    scfmt = f_sc_ok if row["score"]>=90 else (f_sc_w if row["score"]>=60 else f_sc_e)
-                    ufmt  = f_url_fix if row["autocorregible"]=="Sí" else f_url
-                    ws3.write(i+1,0,  row["estado"],        f_err)
-                    ws3.write(i+1,1,  row["score"],         scfmt)
-                    ws3.write(i+1,2,  row["url_original"],  f_url)
-                    ws3.write(i+1,3,  row["url_corregida"], ufmt)
-                    ws3.write(i+1,4,  row["autocorregible"],f_fix_lbl if row["autocorregible"]=="Sí" else f_cell)
-                    ws3.write(i+1,5,  row["correcciones"],  f_cell)
-                    ws3.write(i+1,6,  row["errores"],       f_cell)
-                    ws3.write(i+1,7,  row["avisos"],        f_cell)
-                    ws3.write(i+1,8,  row["utm_source"],    f_mono)
-                    ws3.write(i+1,9,  row["utm_medium"],    f_mono)
-                    ws3.write(i+1,10, row["utm_campaign"],  f_mono)
-                    ws3.write(i+1,11, row["utm_content"],   f_mono)
-                    ws3.write(i+1,12, row["utm_term"],      f_mono)
-
-                # ── Hoja 4: URLs corregidas listas para usar ───────
-                ws4 = wb.add_worksheet("URLs corregidas")
-                ws4.set_tab_color("#16a34a")
-                ws4.freeze_panes(1, 0)
-                ws4.set_row(0, 26)
-                cols4   = ["url_corregida","autocorregible","estado_original","correcciones","utm_source","utm_medium","utm_campaign"]
-                widths4 = [70,14,12,50,18,14,26]
-                labels4 = ["URL corregida","Autocorregible","Estado original","Correcciones aplicadas","utm_source","utm_medium","utm_campaign"]
-                for c,(col,w) in enumerate(zip(labels4,widths4)):
-                    ws4.write(0,c,col,f_hdr)
-                    ws4.set_column(c,c,w)
-
-                for i,(_, row) in enumerate(result_df.iterrows()):
-                    ws4.set_row(i+1,15)
-                    ufmt = f_url_fix if row["autocorregible"]=="Sí" else f_url
-                    sfmt = f_ok if row["estado"]=="OK" else (f_warn if row["estado"]=="Aviso" else f_err)
-                    ws4.write(i+1,0, row["url_corregida"],  ufmt)
-                    ws4.write(i+1,1, row["autocorregible"], f_fix_lbl if row["autocorregible"]=="Sí" else f_cell)
-                    ws4.write(i+1,2, row["estado"],         sfmt)
-                    ws4.write(i+1,3, row["correcciones"],   f_cell)
-                    ws4.write(i+1,4, row["utm_source"],     f_mono)
-                    ws4.write(i+1,5, row["utm_medium"],     f_mono)
-                    ws4.write(i+1,6, row["utm_campaign"],   f_mono)
-
-                wb.close()
-                buf.seek(0)
-                return buf
-
-            excel_buf = build_audit_excel(result_df, avg_score, ok, ko, avisos, n_fixed, total, all_errors)
-            fname     = f"auditoria_utm_{datetime.now().strftime('%Y%m%d_%H%M')}.xlsx"
-
-            c1, c2 = st.columns(2)
-            with c1:
-                st.download_button(
-                    "Descargar auditoría Excel",
-                    data=excel_buf,
-                    file_name=fname,
-                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                    use_container_width=True,
-                    type="primary"
-                )
-            with c2:
-                st.download_button(
-                    "Descargar CSV",
-                    data=result_df.to_csv(index=False).encode(),
-                    file_name=f"auditoria_utm_{datetime.now().strftime('%Y%m%d')}.csv",
-                    mime="text/csv",
-                    use_container_width=True
-                )
-
-            st.caption("El Excel incluye 4 hojas: Resumen ejecutivo · Auditoría completa · Solo errores · URLs corregidas listas para usar.")
+            export_section(key, result_df, avg_score, ok, ko, avisos, n_fixed, total, all_errors, uniq_df)
 
     except Exception as e:
         st.error(f"Error al procesar el archivo: {e}")
+
+# ── Diagnóstico de cachés (solo con ?debug=1 en la URL) ───────────
+if st.query_params.get("debug"):
+    with st.expander("Diagnóstico de cachés", expanded=True):
+        caches = {"URL individual": get_url_cache(), "Auditorías": get_audit_cache(),
+                  "Versiones anteriores": get_snapshot_cache(), "Versiones por clave": get_sheet_versions(),
+                  "Exportaciones": get_export_cache()}
+        st.dataframe(pd.DataFrame.from_dict({name: cache.stats() for name, cache in caches.items()}, orient="index"),
+                     use_container_width=True)